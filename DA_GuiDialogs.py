@@ -13,19 +13,23 @@ class AccessKeyAddWindow(QDialog):
     '''
     Small window used to add new Access Key
     '''
-    def __init__(self, mainX, mainY, backend):
+    def __init__(self, mainX, mainY, backend, tasks):
         '''
         Takes instance of backend in order to create an
-        internal reference to it and manipulate it.
+        internal reference to it and manipulate it, and the
+        TaskRunner of the main window, which validates the
+        credentials in the background.
         '''
         super().__init__()
         
         self.backend = backend
+        self.tasks = tasks
+        self.task = None
         self.Added = False
         
         self.create_Gui(mainX, mainY)
         self.GuiAdd.clicked.connect(self.ActAdd)
-        self.GuiCancel.clicked.connect(self.close)
+        self.GuiCancel.clicked.connect(self.ActCancel)
         
         # disables parrent window until ok or cancel from
         # this window has been clicked.
@@ -77,14 +81,38 @@ class AccessKeyAddWindow(QDialog):
         
     def ActAdd(self):
         '''
-        Calls backend functions to check if profile does not
-        already exists, and if it is valid. If everything ok
+        Calls backend functions, in the background, to check if
+        profile does not already exists, and if it is valid.
+        The result is handled by afterAdd.
+        '''
+        self.GuiAdd.setEnabled(False)
+        self.task = self.tasks.call('Validating Access Key',
+                        self.backend.user_data.add_profile,
+                        self.GuiProfile.text(),
+                        self.GuiAccessKeyId.text(),
+                        self.GuiSecretAccessKey.text(),
+                        callback = self.afterAdd)
+    
+    def ActCancel(self):
+        '''
+        Cancels the validation if it has not started yet (once
+        it runs, afterAdd gets its result), or closes the window.
+        '''
+        if self.task is not None:
+            self.tasks.cancel(self.task)
+        else:
+            self.close()
+    
+    def afterAdd(self, error):
+        '''
+        Called with the result of ActAdd. If everything ok
         it updates the corresponding backend list and ComboBox.
         '''
-        error = self.backend.user_data.add_profile(
-                    self.GuiProfile.text(),
-                    self.GuiAccessKeyId.text(),
-                    self.GuiSecretAccessKey.text())
+        self.task = None
+        self.GuiAdd.setEnabled(True)
+        if error == 'Cancelled':
+            return
+        error_msg = 'Unexpected Error. Possible bug.'
         # Error reporting
         if error is 'NoName':
             error_msg = 'Choose a Name for the Access Key' 
@@ -109,19 +137,23 @@ class SecurityGroupCreateWindow(QDialog):
     '''
     Small window used to add new Security Group
     '''
-    def __init__(self, mainX, mainY, backend):
+    def __init__(self, mainX, mainY, backend, tasks):
         '''
         Takes instance of backend in order to create an
-        internal reference to it and manipulate it.
+        internal reference to it and manipulate it, and the
+        TaskRunner of the main window, which creates the group
+        in the background.
         '''
         super().__init__()
         
         self.backend = backend
+        self.tasks = tasks
+        self.task = None
         self.Created = False
         
         self.create_Gui(mainX, mainY)
         self.GuiAdd.clicked.connect(self.ActAdd)
-        self.GuiCancel.clicked.connect(self.close)
+        self.GuiCancel.clicked.connect(self.ActCancel)
         
         # disables parrent window until ok or cancel from
         # this window has been clicked.
@@ -172,22 +204,45 @@ class SecurityGroupCreateWindow(QDialog):
         
     def ActAdd(self):
         '''
-        Calls backend functions to check if name does not
-        already exists, and if it is valid. If everything ok
-        it updates the corresponding backend list and ComboBox.
+        Calls backend functions, in the background, to check if
+        name does not already exists, and if it is valid. The
+        result is handled by afterAdd.
         '''
         VpcToPass = self.GuiVpc.currentText()
         VpcToPass = VpcToPass.replace(' ', '')
-        error = self.backend.create_security_group(
-                    self.GuiDescription.text(),
-                    self.GuiName.text(),
-                    VpcToPass)
+        self.GuiAdd.setEnabled(False)
+        self.task = self.tasks.run('Creating Security Group',
+                        self.tasks.async_backend.create_security_group(
+                            self.GuiDescription.text(),
+                            self.GuiName.text(),
+                            VpcToPass),
+                        self.afterAdd)
+    
+    def ActCancel(self):
+        '''
+        Cancels the request if it has not started yet (once it
+        runs, afterAdd gets its result), or closes the window.
+        '''
+        if self.task is not None:
+            self.tasks.cancel(self.task)
+        else:
+            self.close()
+    
+    def afterAdd(self, error):
+        '''
+        Called with the result of ActAdd. If everything ok
+        it updates the corresponding backend list and ComboBox.
+        '''
+        self.task = None
+        self.GuiAdd.setEnabled(True)
+        if error == 'Cancelled':
+            return
         # Error reporting
         if error is 'NoName':
             error_msg = 'Choose a Name for the Security Group.' 
         elif error is 'ProfileExists':
             error_msg = 'A Security Group with the given Name already exists.' 
-        elif error is 'Error':
+        else:
             error_msg = 'Unexpected Error. Potential Bug.'
         
         # In NoError, then the backend has been updated
@@ -379,16 +434,28 @@ class InstanceLaunchWindow(QDialog):
     
     def ActLaunch(self):
         '''
-        Attemps to Launch the new AWS instance as
-        specified, otherwise returns error in msgbox.
+        Attemps to Launch the new AWS instance as specified,
+        in the background. The result is handled by afterLaunch.
         '''
-        error = self.backend.launch_instance(
+        self.GuiLaunch.setEnabled(False)
+        self.main.tasks.run('Launching Instance',
+                self.main.tasks.async_backend.launch_instance(
                     self.GuiAmiTag.text(),
                     self.GuiAmiIds.currentText(), 
                     self.GuiInstanceType.currentText(),
                     self.GuiKeyPair.currentText(),
-                    self.GuiSecurity.currentText())
-        if error == 'NoAmiIdError':
+                    self.GuiSecurity.currentText()),
+                self.afterLaunch)
+    
+    def afterLaunch(self, error):
+        '''
+        Called with the result of ActLaunch. Closes the window
+        if successful, otherwise returns error in msgbox.
+        '''
+        self.GuiLaunch.setEnabled(True)
+        if error == 'Cancelled':
+            return
+        elif error == 'NoAmiIdError':
             msg = 'No Image Id was given.'
             QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
         elif error == 'NoTypeError':
@@ -403,7 +470,7 @@ class InstanceLaunchWindow(QDialog):
             # Updates Gui of main window
             self.main.GuiKeyPair.updateList(self.backend.key_pairs)
             self.main.GuiSecurity.updateList(self.backend.security_groups)
-            self.main.refresher.on()
+            self.main.refresher.refreshNow()
             self.close()
         else:
             msg = 'AWS reported error: ' + error
@@ -440,16 +507,22 @@ class InstanceLaunchWindow(QDialog):
                 msg = 'No Image Id was given.'
                 QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
             else:
-                error = self.backend.user_data.add_AMI(id, self.backend.client)
-                if error == 'Error':
-                    msg1 = 'It was not possible to complete the process.'
-                    msg2 = '\n\mEither wrong Image Id was given, or some other'
-                    msg3 = 'connection error.'
-                    msg = msg1+msg2+msg3
-                    QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
-                else:
-                    self.GuiAmiIds.updateList(self.backend.user_data.ImageIds)
-                    self.GuiAmiNames.updateList(self.backend.user_data.ImageNames)
+                self.main.tasks.call('Adding Image', self.backend.add_AMI,
+                                     id, callback = self.afterImageAdd)
+    
+    def afterImageAdd(self, error):
+        '''
+        Called with the result of ActImageAdd.
+        '''
+        if error == 'Error':
+            msg1 = 'It was not possible to complete the process.'
+            msg2 = '\n\mEither wrong Image Id was given, or some other'
+            msg3 = 'connection error.'
+            msg = msg1+msg2+msg3
+            QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
+        elif error == 'NoError':
+            self.GuiAmiIds.updateList(self.backend.user_data.ImageIds)
+            self.GuiAmiNames.updateList(self.backend.user_data.ImageNames)
                     
     def ActImageDelete(self):
         '''
@@ -533,18 +606,27 @@ class InstanceLaunchWindow(QDialog):
                                     'Key Pair Name (without .pem):', 
                                     QLineEdit.Normal, '')
         if okPressed:
-            response = self.backend.create_key_pair(name)
-            if response == 'NoName':
-                error_msg = 'Provide name for the new Key Pair.'
-                QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
-            elif response == 'NameDuplicate':
-                error_msg = 'A Key Pair with the same name already exists.'
-                QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
-            elif response == 'Error':
-                error_msg = 'Unexpected Error. Possible bug.'
-                QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
-            else:
-                self.GuiKeyPair.updateList(self.backend.key_pairs)
+            self.main.tasks.run('Creating Key Pair',
+                    self.main.tasks.async_backend.create_key_pair(name),
+                    self.afterKeyPairCreate)
+    
+    def afterKeyPairCreate(self, response):
+        '''
+        Called with the result of ActKeyPairCreate
+        1) Reports error, or updates GuiKeyPair of both windows.
+        '''
+        if response == 'NoName':
+            error_msg = 'Provide name for the new Key Pair.'
+            QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
+        elif response == 'NameDuplicate':
+            error_msg = 'A Key Pair with the same name already exists.'
+            QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
+        elif response == 'Error':
+            error_msg = 'Unexpected Error. Possible bug.'
+            QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
+        else:
+            self.GuiKeyPair.updateList(self.backend.key_pairs)
+            self.main.GuiKeyPair.updateList(self.backend.key_pairs)
     
     def ActKeyPairDelete(self):
         '''
@@ -564,9 +646,11 @@ class InstanceLaunchWindow(QDialog):
             buttonReply = QMessageBox.question(self, 'Warning',
                             msg, QMessageBox.Yes|QMessageBox.No)
             if buttonReply == QMessageBox.Yes:
-                self.backend.delete_key_pair(
-                    self.GuiKeyPair.currentText())
-                self.GuiKeyPair.updateList(self.backend.key_pairs)
+                self.main.tasks.run('Deleting Key Pair',
+                        self.main.tasks.async_backend.delete_key_pair(
+                            self.GuiKeyPair.currentText()),
+                        lambda r: self.GuiKeyPair.updateList(
+                                        self.backend.key_pairs))
         
     def ActSecurityCreate(self):
         '''
@@ -578,7 +662,8 @@ class InstanceLaunchWindow(QDialog):
         '''
         x = self.mapToGlobal(QPoint(0,0)).x()
         y = self.mapToGlobal(QPoint(0,0)).y()
-        GuiSecurityGroupCreate = SecurityGroupCreateWindow(x, y, self.backend)
+        GuiSecurityGroupCreate = SecurityGroupCreateWindow(x, y, self.backend,
+                                                           self.main.tasks)
         if GuiSecurityGroupCreate.Created:
             self.GuiSecurity.updateList(self.backend.security_groups)
         del GuiSecurityGroupCreate
@@ -606,9 +691,11 @@ class InstanceLaunchWindow(QDialog):
             buttonReply = QMessageBox.question(self, 'Warning',
                             msg, QMessageBox.Yes|QMessageBox.No)
             if buttonReply == QMessageBox.Yes:
-                self.backend.delete_security_group(
-                    self.GuiSecurity.currentText())
-                self.GuiSecurity.updateList(self.backend.security_groups)
+                self.main.tasks.run('Deleting Security Group',
+                        self.main.tasks.async_backend.delete_security_group(
+                            self.GuiSecurity.currentText()),
+                        lambda r: self.GuiSecurity.updateList(
+                                        self.backend.security_groups))
         
 
         
@@ -4,23 +4,34 @@ Collection of classes used to build the GUI.
 
 from PyQt5.QtWidgets import (QWidget, QToolTip, QMessageBox,
                              QFrame, QDesktopWidget, QComboBox,
-                             QGridLayout, QTableWidget, QDialog)
-from PyQt5.QtWidgets import (QToolButton, QMenu)
+                             QGridLayout, QDialog)
+from PyQt5.QtWidgets import (QToolButton, QMenu, QInputDialog)
 from PyQt5.QtGui import (QFont, QIcon)
-from PyQt5.QtCore import QSize
+from PyQt5.QtCore import (QSize, QPoint, QEvent, pyqtSignal, pyqtSlot)
 from DA_GuiSmall import *
-from DA_GuiDialogs import *
+# The windows of DA_GuiDialogs are imported when first opened
+from DA_backend import InstanceFilter, ALL_REGIONS, ALL_PROFILES
+from DA_async import TaskRunner
 
 class Main(CenterWidget):
     '''
     Class of first windon that appears.
     '''
+    # Emits (name, error) when each list requested by
+    # backend.connect (key pairs, security groups, Vpcs) is
+    # ready, from the thread that requested it.
+    metadataReady = pyqtSignal(str, str)
+    # Emitted when backend.discover_regions finishes
+    regionsReady = pyqtSignal()
+    
     def __init__(self, app, backend):
         super().__init__()
         
         self.app = app
         self.backend = backend
         self.refresher = None
+        # Runs the actions that talk to AWS in the background
+        self.tasks = TaskRunner(backend)
         
         # Creates GUI of main Window
         self.setGeometry(300, 300, 550, 450) # X, Y, width , height             
@@ -33,6 +44,8 @@ class Main(CenterWidget):
         # Creates the Actions that connect the backend with
         # the frontend, and binds them to GUI elements
         self.connect_Actions()
+        self.metadataReady.connect(self.applyMetadata)
+        self.regionsReady.connect(self.applyRegions)
         self.setEnabledStates(False)
         
         self.show()
@@ -84,10 +97,11 @@ class Main(CenterWidget):
         self.GuiAccessKeyLabel.move(self.h_com1+15, self.v_lab)
         self.GuiAccessKey = ComboBoxWithUpdate(
                                     self.GuiTop,
-                                    self.backend.user_data.profile)
+                                    self.backend.user_data.profile+[ALL_PROFILES])
         self.GuiAccessKey.move(self.h_com1, self.v_com)
         self.GuiAccessKey.resize(130, 30)
-        self.GuiAccessKey.setToolTip('Access Key used to connect with AWS')
+        self.GuiAccessKey.setToolTip(
+            'Access Key used to connect with AWS, or all of them.')
         self.GuiAccessKeyBtn = ButtonIconMenu('gear.png', self.GuiTop)
         self.GuiAccessKeyBtn.setBtnIconSize(40, 20, 35, 16)
         self.GuiAccessKeyBtn.move(self.h_btn2, self.v_btn)
@@ -98,11 +112,12 @@ class Main(CenterWidget):
         self.GuiRegionsLabel.move(self.h_com2+15, self.v_lab)
         self.GuiRegions = ComboBoxWithUpdate(
                             self.GuiTop,
-                            self.backend.user_data.ec2_regions,
+                            [ALL_REGIONS]+self.backend.user_data.ec2_regions,
                             self.backend.user_data.default_region)
         self.GuiRegions.move(self.h_com2, self.v_com)
         self.GuiRegions.resize(130, 30)
-        self.GuiRegions.setToolTip('Region with which the connection opens.')
+        self.GuiRegions.setToolTip(
+            'Region with which the connection opens, or all of them.')
             
         # Help button and label
         self.GuiHelp = ButtonIcon('questionmark.png', self.GuiTop,
@@ -204,15 +219,24 @@ class Main(CenterWidget):
         self.GuiStateReport = StateReport(self.GuiBottom)
         self.GuiStateReport.move(430, v_dist_btn-17)
         
+        # Filters of the Instances Table
+        self.GuiFilter = FilterBar(self.GuiBottom)
+        self.GuiFilter.move(0, 58)
+        
         # Instances Table
         labels = list(self.backend.user_data.InstanceView.keys())
         self.GuiInstances = InstanceTable(self.GuiBottom, labels)
         self.GuiInstances.setStyleSheet("""
-                    QTableWidget{
+                    QTableView{
                         background-color: rgb(250, 250, 250);
                     }""")
-        self.GuiInstances.move(0, 80)
-        self.GuiInstances.resize(550,200)
+        self.GuiInstances.move(0, 85)
+        self.GuiInstances.resize(550,195)
+        
+        # Progress of the tasks running in the background,
+        # which stays enabled when logged out.
+        self.GuiTaskProgress = TaskProgress(self)
+        self.GuiTaskProgress.move(0, 430)
         
     # ========  Below Actions are defined and binded  ========
     # ========  to the GUI objects of main window     ========    
@@ -267,6 +291,11 @@ class Main(CenterWidget):
         self.GuiInstanceActions.bindMenu(self.ActInstanceActions)
         #    GuiInstanceLaunch Button
         self.GuiInstanceLaunch.clicked.connect(self.ActInstanceLaunch)
+        #    GuiFilter Button
+        self.GuiFilter.GuiApply.clicked.connect(self.ActInstanceFilter)
+        #    GuiTaskProgress
+        self.tasks.progress.connect(self.GuiTaskProgress.setTasks)
+        self.GuiTaskProgress.GuiCancel.clicked.connect(self.tasks.cancelAll)
         
         # Defines Refresher that periodically updates GuiInstances
         # and the corresponding backend object.
@@ -277,35 +306,90 @@ class Main(CenterWidget):
     def ActConnect(self):
         '''
         Triggered by: GuiConnect
-        1) Checks using the backend if connection is possible
-        2) Reports error, and resets enabled states of buttons
+        1) Connects using the backend in the background, while
+            the buttons of GuiTop are disabled.
+        2) The result is handled by afterConnect.
+        '''
+        self.GuiConnect.setEnabled(False)
+        self.GuiAccessKey.setEnabled(False)
+        self.GuiAccessKeyBtn.setEnabled(False)
+        self.GuiRegions.setEnabled(False)
+        self.tasks.run('Connecting',
+                self.tasks.async_backend.connect(
+                    self.GuiAccessKey.currentText(),
+                    self.GuiRegions.currentText(),
+                    callback = self.metadataReady.emit),
+                self.afterConnect)
+    
+    def afterConnect(self, error):
+        '''
+        Called with the result of ActConnect
+        1) Reports error, and resets enabled states of buttons
+        2) The window is enabled as soon as the credentials
+            are validated. The refresher then fills the table
+            region by region, and the key pairs and security
+            groups are filled by applyMetadata when they are
+            ready.
         '''
-        error = self.backend.connect(self.GuiAccessKey.currentText(),
-                                           self.GuiRegions.currentText())
         if error == 'NoAccessKey':
             error_msg = 'Access Key has not been provided.'
             QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
         elif error == 'WrongCredentials':
             error_msg = 'Could not match name with credentials. Possible bug.'
             QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
-        elif error == 'ConnectionError':
+        elif error in ['ConnectionError', 'Error']:
             error_msg = 'Not able to establish connection.'
             QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
-        elif error == 'DescribeError':
+        elif error == 'Throttled':
+            msg1 = 'AWS is limiting the requests of this account.'
+            msg2 = ' Please try again in a few seconds.'
+            error_msg = msg1+msg2
+            QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
+        elif error == 'Cancelled':
+            # Only before connect started, which then never runs
+            self.backend.disconnect()
+        if error != 'NoError':
+            self.setEnabledStates(False)
+        else:
+            self.backend.user_data.default_region = self.GuiRegions.currentText()
+            self.setEnabledStates(True)
+            self.applyRegions()
+            self.GuiKeyPair.updateList(self.backend.key_pairs)
+            self.GuiSecurity.updateList(self.backend.security_groups)
+            self.refresher.on()
+    
+    @pyqtSlot(str, str)
+    def applyMetadata(self, name, error):
+        '''
+        Triggered by: metadataReady
+        1) Updates the list that is ready, or reports the
+            error while requesting it.
+        '''
+        if self.backend.client is None:
+            return
+        if error == 'DescribeError':
             msg1 = 'A connection was successfully established, but'
             msg2 = ' there was an error while requesting data from AWS.'
             msg3 = '\n\nPossible bug because of an update on'
             msg4 = ' a describe_someitem() method.'
             error_msg = msg1+msg2+msg3+msg4
             QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
-        else:
-            self.backend.user_data.default_region = self.GuiRegions.currentText()
-            self.setEnabledStates(True)
+        elif name == 'key_pairs':
             self.GuiKeyPair.updateList(self.backend.key_pairs)
+        elif name == 'security_groups':
             self.GuiSecurity.updateList(self.backend.security_groups)
-            self.backend.user_data.get_AmiNames(self.backend.client)
-            self.refresher.on()
             
+    @pyqtSlot()
+    def applyRegions(self):
+        '''
+        Triggered by: regionsReady
+        1) Updates GuiRegions with the discovered regions,
+            keeping the one that is selected.
+        '''
+        self.GuiRegions.updateList(
+                [ALL_REGIONS]+self.backend.user_data.ec2_regions,
+                self.GuiRegions.currentText())
+        
     def ActHelp(self):
         '''
         Triggered by: GuiHelp
@@ -333,9 +417,12 @@ class Main(CenterWidget):
         '''
         x = self.mapToGlobal(QPoint(0,0)).x()
         y = self.mapToGlobal(QPoint(0,0)).y()
-        GuiAccessKeyWinAdd = AccessKeyAddWindow(x, y, self.backend)
+        from DA_GuiDialogs import AccessKeyAddWindow
+        GuiAccessKeyWinAdd = AccessKeyAddWindow(x, y, self.backend,
+                                                self.tasks)
         if GuiAccessKeyWinAdd.Added:
-            self.GuiAccessKey.updateList(self.backend.user_data.profile)
+            self.GuiAccessKey.updateList(
+                    self.backend.user_data.profile+[ALL_PROFILES])
         del GuiAccessKeyWinAdd
         
     def ActAccessKeyWinDelete(self):
@@ -355,7 +442,8 @@ class Main(CenterWidget):
             if buttonReply == QMessageBox.Yes:
                 self.backend.user_data.delete_profile(
                     self.GuiAccessKey.currentText())
-                self.GuiAccessKey.updateList(self.backend.user_data.profile)
+                self.GuiAccessKey.updateList(
+                    self.backend.user_data.profile+[ALL_PROFILES])
     
     # ==================== GuiMid Actions ====================
     # ======================================================== 
@@ -393,18 +481,26 @@ class Main(CenterWidget):
                                     'Key Pair Name (without .pem):', 
                                     QLineEdit.Normal, '')
         if okPressed:
-            response = self.backend.create_key_pair(name)
-            if response == 'NoName':
-                error_msg = 'Provide name for the new Key Pair.'
-                QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
-            elif response == 'NameDuplicate':
-                error_msg = 'A Key Pair with the same name already exists.'
-                QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
-            elif response == 'Error':
-                error_msg = 'Unexpected Error. Possible bug.'
-                QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
-            else:
-                self.GuiKeyPair.updateList(self.backend.key_pairs)
+            self.tasks.run('Creating Key Pair',
+                    self.tasks.async_backend.create_key_pair(name),
+                    self.afterKeyPairCreate)
+    
+    def afterKeyPairCreate(self, response):
+        '''
+        Called with the result of ActKeyPairCreate
+        1) Reports error, or updates GuiKeyPair.
+        '''
+        if response == 'NoName':
+            error_msg = 'Provide name for the new Key Pair.'
+            QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
+        elif response == 'NameDuplicate':
+            error_msg = 'A Key Pair with the same name already exists.'
+            QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
+        elif response == 'Error':
+            error_msg = 'Unexpected Error. Possible bug.'
+            QMessageBox.information(self, 'Error', error_msg, QMessageBox.Ok)
+        else:
+            self.GuiKeyPair.updateList(self.backend.key_pairs)
     
     def ActKeyPairDelete(self):
         '''
@@ -424,9 +520,11 @@ class Main(CenterWidget):
             buttonReply = QMessageBox.question(self, 'Warning',
                             msg, QMessageBox.Yes|QMessageBox.No)
             if buttonReply == QMessageBox.Yes:
-                self.backend.delete_key_pair(
-                    self.GuiKeyPair.currentText())
-                self.GuiKeyPair.updateList(self.backend.key_pairs)
+                self.tasks.run('Deleting Key Pair',
+                        self.tasks.async_backend.delete_key_pair(
+                            self.GuiKeyPair.currentText()),
+                        lambda r: self.GuiKeyPair.updateList(
+                                        self.backend.key_pairs))
     
     def ActSecurityCreate(self):
         '''
@@ -438,7 +536,9 @@ class Main(CenterWidget):
         '''
         x = self.mapToGlobal(QPoint(0,0)).x()
         y = self.mapToGlobal(QPoint(0,0)).y()
-        GuiSecurityGroupCreate = SecurityGroupCreateWindow(x, y, self.backend)
+        from DA_GuiDialogs import SecurityGroupCreateWindow
+        GuiSecurityGroupCreate = SecurityGroupCreateWindow(x, y, self.backend,
+                                                           self.tasks)
         if GuiSecurityGroupCreate.Created:
             self.GuiSecurity.updateList(self.backend.security_groups)
         del GuiSecurityGroupCreate
@@ -466,9 +566,11 @@ class Main(CenterWidget):
             buttonReply = QMessageBox.question(self, 'Warning',
                             msg, QMessageBox.Yes|QMessageBox.No)
             if buttonReply == QMessageBox.Yes:
-                self.backend.delete_security_group(
-                    self.GuiSecurity.currentText())
-                self.GuiSecurity.updateList(self.backend.security_groups)
+                self.tasks.run('Deleting Security Group',
+                        self.tasks.async_backend.delete_security_group(
+                            self.GuiSecurity.currentText()),
+                        lambda r: self.GuiSecurity.updateList(
+                                        self.backend.security_groups))
     
     # ================= GuiBottom Actions ====================
     # ========================================================
@@ -485,7 +587,7 @@ class Main(CenterWidget):
             element of Backend.user_data.InstanceView.
         4) Those (un)check the element of the frontend menu,
             update backend list, and call ActInstanceViewUpdate 
-            to update GuiInstance (QTableWidget)
+            to update GuiInstance (QTableView)
         '''
         backendDict = self.backend.user_data.InstanceView
         Keys = list(backendDict.keys())
@@ -516,17 +618,18 @@ class Main(CenterWidget):
         Triggered by: GuiInstanceView --> AttributeAction
         1) Updates the Backend Attribute to be on the same
             state (True, False) with that of the fronend menu.
-        2) Refreshes GuiInstance (QTableWidget). 
+        2) Refreshes GuiInstance (QTableView). 
         '''
         backendDict = self.backend.user_data.InstanceView
         Keys = list(backendDict.keys())
         for i in Keys:
             self.backend.user_data.InstanceView[i] \
             = self.ActInstanceView[i].isChecked()
-        self.backend.user_data.save()
-        self.GuiInstances.refresh(
-                self.backend.user_data.InstanceView,
-                self.backend.instancesData)
+        self.backend.user_data.save('InstanceView')
+        self.GuiInstances.refresh(self.backend.user_data.InstanceView)
+        # The requests to AWS depend on the visible columns, so
+        # newly shown columns are filled with an update.
+        self.refresher.refreshNow()
     
     def ActInstanceViewSelectAll(self):
         '''
@@ -539,10 +642,11 @@ class Main(CenterWidget):
         for i in Keys:
             self.backend.user_data.InstanceView[i] = True
             self.ActInstanceView[i].setChecked(True)
-        self.backend.user_data.save()
-        self.GuiInstances.refresh(
-                self.backend.user_data.InstanceView,
-                self.backend.instancesData)
+        self.backend.user_data.save('InstanceView')
+        self.GuiInstances.refresh(self.backend.user_data.InstanceView)
+        # The requests to AWS depend on the visible columns, so
+        # newly shown columns are filled with an update.
+        self.refresher.refreshNow()
     
     def ActInstanceViewDeselectAll(self):
         '''
@@ -555,10 +659,23 @@ class Main(CenterWidget):
         for i in Keys:
             self.backend.user_data.InstanceView[i] = False
             self.ActInstanceView[i].setChecked(False)
-        self.backend.user_data.save()
-        self.GuiInstances.refresh(
-                self.backend.user_data.InstanceView,
-                self.backend.instancesData)
+        self.backend.user_data.save('InstanceView')
+        self.GuiInstances.refresh(self.backend.user_data.InstanceView)
+        # The requests to AWS depend on the visible columns, so
+        # newly shown columns are filled with an update.
+        self.refresher.refreshNow()
+    
+    def ActInstanceFilter(self):
+        '''
+        Triggered by: GuiFilter --> Filter
+        1) Passes the filters of GuiFilter to the backend, which
+            uses them on every following request to AWS.
+        2) Asks for an immediate update of GuiInstances, which
+            drops the rows that no longer match.
+        '''
+        self.backend.instance_filter = InstanceFilter(
+                                    **self.GuiFilter.values())
+        self.refresher.refreshNow()
     
     def ActInstanceActionsCreateMenu(self):
         '''
@@ -566,7 +683,7 @@ class Main(CenterWidget):
         1) Creates a Menu with the actions that will go
             into GuiInstanceView.
         2) Those, stop, reboot, and terminate an instances
-            if it is selected from GuiInstances (QTableWidget).
+            if it is selected from GuiInstances (QTableView).
         '''
         self.ActInstanceActions = {}
         self.ActInstanceActions['Start'] = QAction('Start',
@@ -594,7 +711,7 @@ class Main(CenterWidget):
         '''
         Triggered by: GuiInstanceActions --> More
         1) If a row with a running instance is selected on GuiInstances
-            (QTableWidget), then it pops up a box with information on
+            (QTableView), then it pops up a box with information on
             how to connect to this instance through the terminal, or
             other.
         2) Otherwise, provides appropriate messages to user.
@@ -611,14 +728,15 @@ class Main(CenterWidget):
             msg = 'Select a single AWS Instance.'
             QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
         else:
-            msg = self.backend.get_more_info(srd[0])
+            msg = self.backend.get_more_info(
+                        self.GuiInstances.selectedIds(srd)[0])
             QMessageBox.information(self, 'More Information', msg, QMessageBox.Ok)
     
     def ActInstanceStart(self):
         '''
         Triggered by: GuiInstanceActions --> Start
         1) If a row with a stopped instance is selected on GuiInstances
-            (QTableWidget), then it requests from AWS to start it.
+            (QTableView), then it requests from AWS to start it.
         2) If successful, updates backend list and GuiInstances.
         3) Otherwise, provides appropriate messages to user.
         '''
@@ -640,31 +758,13 @@ class Main(CenterWidget):
                 msg = msg1+msg2
             QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
         else:
-            error = self.backend.act_instances(sr, 'start')
-            if error == 'IndexDoesNotExist':
-                msg1 = 'Could not match frontend and backend indexes.'
-                msg2 = ' Potential bug.'
-                msg = msg1+msg2
-            elif error == 'ConnectionError':
-                self.get_instances()
-                self.GuiInstances.refresh(self.backend.user_data.InstanceView)
-                msg1 = 'Error while communicating with AWS. An attempt'
-                msg2 = ' to update Table with AWS Instances was made.'
-                msg3 = ' To be on the safe side also check using the'
-                msg4 = ' AWS website.'
-                msg = msg1+msg2+msg3+msg4
-                QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
-            else:
-                self.backend.get_instances()
-                self.GuiInstances.refresh(
-                    self.backend.user_data.InstanceView,
-                    self.backend.instancesData)
+            self.actInstances(sr, 'start', 'Starting Instances')
                 
     def ActInstanceStop(self):
         '''
         Triggered by: GuiInstanceActions --> Stop
         1) If a row with a running instance is selected on GuiInstances
-            (QTableWidget), then it requests from AWS to stop it.
+            (QTableView), then it requests from AWS to stop it.
         2) If successful, updates backend list and GuiInstances.
         3) Otherwise, provides appropriate messages to user.
         '''
@@ -687,31 +787,13 @@ class Main(CenterWidget):
                 msg = msg1+msg2
             QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
         else:
-            error = self.backend.act_instances(sr, 'stop')
-            if error == 'IndexDoesNotExist':
-                msg1 = 'Could not match frontend and backend indexes.'
-                msg2 = ' Potential bug.'
-                msg = msg1+msg2
-            elif error == 'ConnectionError':
-                self.get_instances()
-                self.GuiInstances.refresh(self.backend.user_data.InstanceView)
-                msg1 = 'Error while communicating with AWS. An attempt'
-                msg2 = ' to update Table with AWS Instances was made.'
-                msg3 = ' To be on the safe side also check using the'
-                msg4 = ' AWS website.'
-                msg = msg1+msg2+msg3+msg4
-                QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
-            else:
-                self.backend.get_instances()
-                self.GuiInstances.refresh(
-                    self.backend.user_data.InstanceView,
-                    self.backend.instancesData)
+            self.actInstances(sr, 'stop', 'Stopping Instances')
     
     def ActInstanceReboot(self):
         '''
         Triggered by: GuiInstanceActions --> Reboot
         1) If a row with a running instance is selected on GuiInstances
-            (QTableWidget), then it requests from AWS to reboot it.
+            (QTableView), then it requests from AWS to reboot it.
         2) If successful, updates backend list and GuiInstances.
         3) Otherwise, provides appropriate messages to user.
         '''
@@ -733,31 +815,13 @@ class Main(CenterWidget):
                 msg = msg1+msg2
             QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
         else:
-            error = self.backend.act_instances(sr, 'reboot')
-            if error == 'IndexDoesNotExist':
-                msg1 = 'Could not match frontend and backend indexes.'
-                msg2 = ' Potential bug.'
-                msg = msg1+msg2
-            elif error == 'ConnectionError':
-                self.get_instances()
-                self.GuiInstances.refresh(self.backend.user_data.InstanceView)
-                msg1 = 'Error while communicating with AWS. An attempt'
-                msg2 = ' to update Table with AWS Instances was made.'
-                msg3 = ' To be on the safe side also check using the'
-                msg4 = ' AWS website.'
-                msg = msg1+msg2+msg3+msg4
-                QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
-            else:
-                self.backend.get_instances()
-                self.GuiInstances.refresh(
-                    self.backend.user_data.InstanceView,
-                    self.backend.instancesData)
+            self.actInstances(sr, 'reboot', 'Rebooting Instances')
         
     def ActInstanceTerminate(self):
         '''
         Triggered by: GuiInstanceActions --> Terminate
         1) If a row with a running or stopped instance is selected
-            on GuiInstances (QTableWidget), then it requests from 
+            on GuiInstances (QTableView), then it requests from 
             AWS to terminate it.
         2) If successful, updates backend list and GuiInstances.
         3) Otherwise, provides appropriate messages to user.
@@ -783,25 +847,72 @@ class Main(CenterWidget):
                 msg = msg1+msg2+msg3+msg4
             QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
         else:
-            error = self.backend.act_instances(sr, 'terminate')
-            if error == 'IndexDoesNotExist':
-                msg1 = 'Could not match frontend and backend indexes.'
-                msg2 = ' Potential bug.'
-                msg = msg1+msg2
-            elif error == 'ConnectionError':
-                self.get_instances()
-                self.GuiInstances.refresh(self.backend.user_data.InstanceView)
-                msg1 = 'Error while communicating with AWS. An attempt'
-                msg2 = ' to update Table with AWS Instances was made.'
-                msg3 = ' To be on the safe side also check using the'
-                msg4 = ' AWS website.'
-                msg = msg1+msg2+msg3+msg4
-                QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
-            else:
-                self.backend.get_instances()
-                self.GuiInstances.refresh(
-                    self.backend.user_data.InstanceView,
-                    self.backend.instancesData)
+            self.actInstances(sr, 'terminate', 'Terminating Instances')
+    
+    def actInstances(self, sr, act, text):
+        '''
+        Part of ActInstanceStart/Stop/Reboot/Terminate
+        1) Requests act on the instances of the rows sr in
+            the background, and shows text meanwhile.
+        2) The result is handled by afterAct.
+        '''
+        self.tasks.run(text,
+                self.tasks.async_backend.act_instances(
+                    self.GuiInstances.selectedIds(sr), act),
+                self.afterAct)
+    
+    def afterAct(self, results):
+        '''
+        Called with the result of actInstances
+        1) Updates backend list and GuiInstances with the new
+            state of each instance, and marks the rows of the
+            instances that failed. The instances that are
+            changing state are then polled by the refresher.
+        2) Provides appropriate messages to user.
+        '''
+        if results == 'IdDoesNotExist':
+            msg1 = 'Could not match frontend and backend instances.'
+            msg2 = ' Potential bug.'
+            msg = msg1+msg2
+            QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
+            return
+        errors = {}
+        if results not in ['Error', 'Cancelled']:
+            # Instances that are now pending or stopping are
+            # followed by the refresher until they settle,
+            # starting right away.
+            diff = self.backend.apply_act_results(results)
+            self.GuiInstances.applyDiff(diff)
+            if not diff.isEmpty():
+                self.refresher.wakeUp()
+            for i, [state, error] in results.items():
+                if error != '':
+                    errors[i] = error
+            self.GuiInstances.setErrors(errors)
+        # Otherwise, it is not known what happened to them
+        if errors or results in ['Error', 'Cancelled']:
+            self.refresher.refreshNow()
+        if results == 'Error' or 'ConnectionError' in errors.values():
+            msg1 = 'Error while communicating with AWS. An attempt'
+            msg2 = ' to update Table with AWS Instances was made.'
+            msg3 = ' To be on the safe side also check using the'
+            msg4 = ' AWS website.'
+            msg = msg1+msg2+msg3+msg4
+            QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
+        elif 'Throttled' in errors.values():
+            msg1 = 'AWS is limiting the requests of this account, so'
+            msg2 = ' %d of %d AWS Instances could not be acted upon.' % (
+                        len(errors), len(results))
+            msg3 = '\n\nPlease try again in a few seconds.'
+            msg = msg1+msg2+msg3
+            QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
+        elif errors:
+            msg1 = '%d of %d AWS Instances could not be acted upon.' % (
+                        len(errors), len(results))
+            msg2 = '\n\nTheir rows are marked on the Table, and the'
+            msg3 = ' error of each is shown when the mouse is over it.'
+            msg = msg1+msg2+msg3
+            QMessageBox.information(self, 'Error', msg, QMessageBox.Ok)
     
     def ActInstanceLaunch(self):
         '''
@@ -809,8 +920,9 @@ class Main(CenterWidget):
         1) Pops up window for the user to provide details
             on the AWS instance she want to start.
         2) Launches the AWS instance and updates
-            Instances (QTableWidget).
+            Instances (QTableView).
         '''
+        from DA_GuiDialogs import InstanceLaunchWindow
         GuiInstanceLaunchWindow = InstanceLaunchWindow(self)
     
     def setEnabledStates(self, logged_in):
@@ -833,11 +945,24 @@ class Main(CenterWidget):
     # ========================================================              
     # ========================================================
         
+    def changeEvent(self, event):
+        '''
+        triggered by: focus or minimize/restore of the window
+        1) Lets the refresher slow down while the window is
+            not active or minimized.
+        '''
+        if event.type() in [QEvent.ActivationChange,
+                            QEvent.WindowStateChange]:
+            self.refresher.setWindowState(self.isActiveWindow(),
+                                          self.isMinimized())
+        super().changeEvent(event)
+    
     def closeEvent(self, event):
         '''
         triggered by: 'x button on titlebar'
         1) Asks user to confirm she want to close the app and
             if yes, then it closes it.
+        2) Writes the user data that have not been saved yet.
         '''
         msg1 = 'This will not stop any AWS instances currently running.'
         msg2 = '\n\nDo you still want to close the application?'
@@ -846,7 +971,9 @@ class Main(CenterWidget):
             QMessageBox.Yes | 
             QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            self.refresher.off()
+            self.refresher.shutdown()
+            self.tasks.shutdown()
+            self.backend.user_data.flush()
             event.accept()
         else:
             event.ignore()
@@ -854,18 +981,269 @@ class Main(CenterWidget):
 # =============  Used to setup a timer  ======================              
 # ==========  to refresh the main window  ====================
 
-from threading import Timer
-class MainRefresher():
+import time
+from PyQt5.QtCore import (QObject, QThread, QTimer,
+                          pyqtSignal, pyqtSlot)
+from PyQt5 import sip
+from DA_clients import client_pool, BACKGROUND
+class RefreshSchedule():
+    '''
+    Interval between the ticks of RefreshWorker, which adapts
+    to what is going on:
+    1) It is min_interval while instances change or are in a
+        transition state, and grows by factor on every quiet
+        tick, up to max_interval.
+    2) It doubles while the main window is not active, and is
+        at least hidden_interval while it is minimized.
+    3) It is four times longer while AWS throttles requests.
+    
+    The interval runs from the start of one tick to the start
+    of the next. A tick that takes longer than the interval
+    overruns it, and the ticks it missed are skipped, rather
+    than run back to back once it ends.
+    '''
+    def __init__(self, min_interval = 1, max_interval = 10,
+                 factor = 1.5, hidden_interval = 60):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.hidden_interval = hidden_interval
+        self.interval = min_interval
+        self.active = True
+        self.hidden = False
+        self.throttled = False
+        # Measured duration of the last tick (sec), and
+        # number of overrun and skipped ticks.
+        self.latency = 0
+        self.overruns = 0
+        self.skipped = 0
+    
+    def current(self):
+        '''Returns the interval that applies now (in sec)'''
+        interval = self.interval
+        if self.throttled:
+            interval *= 4
+        if self.hidden:
+            interval = max(interval, self.hidden_interval)
+        elif not self.active:
+            interval *= 2
+        return interval
+    
+    def reset(self):
+        '''Goes back to min_interval (e.g. after a user action)'''
+        self.interval = self.min_interval
+    
+    def tickDone(self, latency, changed, throttled):
+        '''
+        latency --> duration of the tick (in sec)
+        changed --> True if some instance changed, or is in a
+                    transition state
+        throttled --> True if AWS throttled recent requests
+        Returns the delay until the next tick (in sec).
+        '''
+        self.latency = latency
+        self.throttled = throttled
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.factor,
+                                self.max_interval)
+        interval = self.current()
+        if latency <= interval:
+            return interval - latency
+        # Keeps the next tick on the schedule of the interval
+        self.overruns += 1
+        self.skipped += int(latency // interval)
+        return interval - latency % interval
+    
+    def stats(self):
+        '''Returns dict with the measurements of the schedule'''
+        return {'latency': self.latency,
+                'interval': self.current(),
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'throttled': self.throttled}
+
+class RefreshWorker(QObject):
+    '''
+    Lives on the background QThread of MainRefresher. A
+    single long-lived QTimer calls tick(), which does the
+    AWS requests away from the GUI thread and emits the
+    finished snapshot with snapshotReady. The timer is
+    started again at the end of each tick, with the delay
+    given by a RefreshSchedule.
+    
+    Only the instances that are changing state are requested
+    on every tick (see Backend.poll_transitions). All
+    instances are requested every sweep sec, or when run()
+    is called directly (e.g. by MainRefresher.refreshNow).
+    '''
+    # Emits the InstanceDiff of each target (profile and
+    # region), as soon as the target is ready, and then the
+    # latency and error of every target (Backend.target_reports).
+    snapshotReady = pyqtSignal(object)
+    reportReady   = pyqtSignal(dict)
+    # Emits RefreshSchedule.stats() at the end of each tick,
+    # with the number of throttled requests (throttle_count).
+    tickReady     = pyqtSignal(dict)
+    
+    def __init__(self, interval, backend, sweep = 15):
+        '''
+        interval --> shortest interval between ticks (in sec)
+        backend --> Instance of Backend used by Main Window
+        sweep --> interval between full updates (in sec)
+        '''
+        super().__init__()
+        self.interval = interval
+        self.backend  = backend
+        self.sweep    = sweep
+        self.schedule = RefreshSchedule(min_interval = interval)
+        self.running  = False
+        self._timer   = None
+        self._lastSweep = 0
+    
+    @pyqtSlot()
+    def start(self):
+        '''Starts the timer, from within the worker thread'''
+        # The timer is created here so that it belongs
+        # to the worker thread.
+        if self._timer is None:
+            # Requests of this thread give way to the
+            # ones of the user (see DA_clients).
+            client_pool.set_priority(BACKGROUND)
+            self._timer = QTimer(self)
+            self._timer.setSingleShot(True)
+            self._timer.timeout.connect(self.tick)
+        self.running = True
+        self.schedule.reset()
+        # The first tick is a full update, which fills the
+        # table right after connect.
+        self._lastSweep = 0
+        self._timer.start(0)
+    
+    @pyqtSlot()
+    def stop(self):
+        '''Stops the timer, from within the worker thread'''
+        self.running = False
+        if self._timer is not None:
+            self._timer.stop()
+    
+    @pyqtSlot(bool, bool)
+    def setWindowState(self, active, hidden):
+        '''
+        active --> True if the main window has the focus
+        hidden --> True if the main window is minimized
+        '''
+        wasHidden = self.schedule.hidden
+        self.schedule.active = active
+        self.schedule.hidden = hidden
+        # Catches up at once when the window is shown again
+        if wasHidden and not hidden and self.running:
+            self.schedule.reset()
+            self._timer.start(0)
+    
+    @pyqtSlot()
+    def wakeUp(self):
+        '''
+        Goes back to the shortest interval, and ticks at once
+        (e.g. after an action, so that the new transitions are
+        followed closely).
+        '''
+        self.schedule.reset()
+        if self.running:
+            self._timer.start(0)
+    
+    @pyqtSlot()
+    def tick(self):
+        '''
+        Polls the instances that are changing, or all of
+        them if the last full update is sweep sec old, and
+        schedules the next tick.
+        '''
+        start = time.time()
+        if start - self._lastSweep >= self.sweep:
+            changed = self.update()
+        else:
+            diff = self.backend.poll_transitions(
+                    callback = self.snapshotReady.emit)
+            changed = not diff.isEmpty()
+        changed = changed or not self.backend.transitions.isEmpty()
+        delay = self.schedule.tickDone(time.time() - start, changed,
+                                       self.backend.isThrottled())
+        if self.running:
+            self._timer.start(int(delay*1000))
+        stats = self.schedule.stats()
+        stats['throttle_count'] = self.backend.throttle_count()
+        self.tickReady.emit(stats)
+    
+    @pyqtSlot(float)
+    def run(self, requested = 0):
+        '''
+        Asks backend for a full update, requested at the given
+        time. Requests that arrive while an update runs are
+        merged, i.e. skipped if an update started after them.
+        '''
+        if self._lastSweep >= requested:
+            return
+        self.schedule.reset()
+        self.update()
+    
+    def update(self):
+        '''
+        Does a full update, emits it, and returns True if
+        something changed.
+        '''
+        self._lastSweep = time.time()
+        # Only targets where something changed are emitted.
+        # Errors are simply retried on the next sweep.
+        diff = self.backend.get_instances(
+                    callback = self.snapshotReady.emit)
+        self.reportReady.emit(dict(self.backend.target_reports))
+        return not isinstance(diff, str) and not diff.isEmpty()
+
+class MainRefresher(QObject):
+    '''
+    Used to refresh the content of GuiInstances of the
+    main window. The AWS requests are done by a RefreshWorker
+    on a background QThread, and the snapshots it produces
+    are applied to GuiInstances on the GUI thread through
+    queued signals.
+    '''
+    # Signals used to control the worker within its thread
+    startRequested = pyqtSignal()
+    stopRequested  = pyqtSignal()
+    runRequested   = pyqtSignal(float)
+    wakeRequested  = pyqtSignal()
+    windowStateChanged = pyqtSignal(bool, bool)
+    
     def __init__(self, interval, main):
         '''
-        Used to refresh the content of GuiInstances of
-        the main window.
-        interval --> interval between refreshing
+        interval --> shortest interval between refreshing
         main --> Instance of Main Window as defined above
         '''
-        self._timer   = None
+        super().__init__()
         self.interval = interval
         self.main     = main
+        self.running  = False
+        # Last RefreshSchedule.stats() of the worker, e.g.
+        # stats['latency'] is the duration of the last tick.
+        self.stats    = {}
+        
+        # Single background thread and worker, which are
+        # kept for the whole life of the main window.
+        self._thread = QThread()
+        self._worker = RefreshWorker(interval, main.backend)
+        self._worker.moveToThread(self._thread)
+        self.startRequested.connect(self._worker.start)
+        self.stopRequested.connect(self._worker.stop)
+        self.runRequested.connect(self._worker.run)
+        self.wakeRequested.connect(self._worker.wakeUp)
+        self.windowStateChanged.connect(self._worker.setWindowState)
+        self._worker.snapshotReady.connect(self.applySnapshot)
+        self._worker.reportReady.connect(self.applyReport)
+        self._worker.tickReady.connect(self.applyTick)
+        self._thread.finished.connect(self._worker.deleteLater)
+        self._thread.start()
     
     def on(self):
         '''Call to set the timer running'''
@@ -873,43 +1251,92 @@ class MainRefresher():
         self.main.GuiInstances.refresh(
             self.main.backend.user_data.InstanceView,
             self.main.backend.instancesData)
-        # Switch to run, which allows for inplace
+        # Lets the worker run, which allows for inplace
         # update to GuiInstances.
-        self._timer = Timer(self.interval, self.run)
-        self._timer.start()
+        self.running = True
+        self.startRequested.emit()
         # Updates GuiStateReport
         self.main.GuiStateReport.isOnOff('on')
     
-    def run(self):
-        '''Call to set the timer running'''
-        # Takes backend report on update on instances
-        change = self.main.backend.get_instances()
-        # Calls refresh or inplaceRefresh
-        if change == 'InstanceChange':
-            print('Big')
-            # Does a big update that unselects all rows
-            self.main.GuiInstances.refresh(
-                self.main.backend.user_data.InstanceView,
-                self.main.backend.instancesData)
-        elif change == 'AttributeChange':
-            # Only updates items, does not affect selection
-            self.main.GuiInstances.inplaceRefresh(
-                self.main.backend.instancesData)
-        # Continues calling run().
-        self._timer = Timer(self.interval, self.run)
-        self._timer.start()
+    @pyqtSlot(object)
+    def applySnapshot(self, diff):
+        '''
+        Called on the GUI thread with each snapshot emitted
+        by the worker. Patches only the rows of GuiInstances
+        that changed, which keeps the selection.
+        '''
+        # Snapshots that arrive after off() are ignored
+        if not self.running:
+            return
+        self.main.GuiInstances.applyDiff(diff)
+    
+    @pyqtSlot(dict)
+    def applyReport(self, reports):
+        '''
+        Called on the GUI thread at the end of each update,
+        with the latency and error of every target.
+        '''
+        if not self.running:
+            return
         # Updates GuiStateReport
         self.main.GuiStateReport.isOnOff('on')
+        self.main.GuiStateReport.setReport(reports)
+    
+    @pyqtSlot(dict)
+    def applyTick(self, stats):
+        '''
+        Called on the GUI thread at the end of each tick,
+        with the measurements of the schedule.
+        '''
+        self.stats = stats
+        if self.running:
+            self.main.GuiStateReport.setTick(stats)
+    
+    def setWindowState(self, active, hidden):
+        '''
+        Passes the state of the main window to the worker,
+        which refreshes less often when it is not seen.
+        '''
+        self.windowStateChanged.emit(active, hidden)
+    
+    def wakeUp(self):
+        '''
+        Asks the worker to poll the instances in transition
+        at once, and to go back to the shortest interval.
+        '''
+        if self.running:
+            self.wakeRequested.emit()
+    
+    def refreshNow(self):
+        '''Asks the worker for an immediate full update'''
+        if self.running:
+            self.runRequested.emit(time.time())
     
     def off(self):
         '''Call to set the timer off'''
-        if self._timer is not None:
-            self._timer.cancel()
-            self._timer = None
+        if self.running:
+            self.running = False
+            self.stopRequested.emit()
             self.main.GuiInstances.totalClear()
         # Updates GuiStateReport
         self.main.GuiStateReport.isOnOff('off')
-            
+    
+    def shutdown(self, timeout = 1000):
+        '''
+        Stops the worker and its thread for good. A sweep that
+        is still running (e.g. on a region that does not answer)
+        is waited for at most timeout ms, so that the window
+        closes at once. Its results are then dropped, as the
+        backend disconnects (see Backend.connect_id).
+        '''
+        self.off()
+        self._thread.quit()
+        if not self._thread.wait(timeout):
+            self.main.backend.disconnect()
+            # The thread finishes on its own. Python gives up
+            # its ownership, so that it is not destroyed while
+            # it runs.
+            sip.transferto(self._thread, None)
             
 from PyQt5.QtWidgets import QLabel
 from PyQt5.QtGui import QPixmap
@@ -934,10 +1361,15 @@ class StateReport(QFrame):
         self.BotLabel = QLabel(self)
         self.BotLabel.resize(60,30)
         self.BotLabel.setScaledContents(True)
+        self.reportLines = []
+        self.tickLine = ''
         self.isOnOff('off')
     def isOnOff(self, OnOff):
         if OnOff == 'off':
             self.state = 0
+            self.reportLines = []
+            self.tickLine = ''
+            self.setToolTip('')
             #self.BotLabel.move(23,18)
             self.BotLabel.move(0,18)
         elif OnOff == 'on':
@@ -948,6 +1380,37 @@ class StateReport(QFrame):
             else:
                 self.state += 1
         self.setState()
+    def setReport(self, reports):
+        '''
+        reports --> dict as Backend.target_reports
+        Shows the latency or the error of each target (profile
+        and region) as the ToolTip.
+        '''
+        lines = []
+        for target in sorted(reports):
+            r = reports[target]
+            if r['error'] != '':
+                lines.append(target + ': ' + r['error'])
+            else:
+                lines.append(target + ': %.2f sec' % r['latency'])
+        self.reportLines = lines
+        self.setToolTip('\n'.join(self.reportLines + [self.tickLine]))
+    def setTick(self, stats):
+        '''
+        stats --> dict as emitted by RefreshWorker.tickReady
+        Adds the duration and interval of the refresh, and
+        the number of throttled requests, to the ToolTip.
+        '''
+        self.tickLine = 'Refresh: %.2f sec, every %.1f sec' % (
+                            stats['latency'], stats['interval'])
+        if stats['overruns']:
+            self.tickLine += ', %d overruns' % stats['overruns']
+        if stats['throttled']:
+            self.tickLine += ', throttled'
+        if stats.get('throttle_count'):
+            self.tickLine += '\nRequests throttled by AWS: %d' % (
+                                stats['throttle_count'])
+        self.setToolTip('\n'.join(self.reportLines + [self.tickLine]))
     def setState(self):
         if self.state == 0:
             #self.TopLabel.setText('Disconnected')
@@ -7,9 +7,10 @@ PyQt5.QtWidgets in all apart from the StyleSheet.
 from PyQt5.QtWidgets import (QWidget, QPushButton, QLabel,
                              QDesktopWidget, QLineEdit,
                              QToolButton, QMenu, QAction,
-                             QComboBox, QTableWidget,
-                             QTableWidgetItem, QAbstractItemView)
-from PyQt5.QtGui import (QFont, QIcon)
+                             QComboBox, QTableView,
+                             QHeaderView, QAbstractItemView,
+                             QProgressBar)
+from PyQt5.QtGui import (QFont, QIcon, QColor)
 from PyQt5.QtCore import QSize
 import PyQt5.QtCore as QtCore
 
@@ -274,17 +275,267 @@ class ButtonMenu(QToolButton):
         self.setMenu(toolmenu)
         self.setPopupMode(QToolButton.InstantPopup)
 
-class InstanceTable(QTableWidget):
+class TaskProgress(QWidget):
     '''
-    QTableWidget that also:
+    Thin bar that shows the tasks running in the background
+    (see DA_async.TaskRunner), with a busy indicator and a
+    button that cancels them. It is hidden when idle.
+    '''
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.resize(550, 20)
+        self.GuiText = QLabel(self)
+        self.GuiText.move(10, 2)
+        self.GuiText.resize(330, 16)
+        self.GuiBusy = QProgressBar(self)
+        self.GuiBusy.move(350, 4)
+        self.GuiBusy.resize(120, 12)
+        # Busy indicator, as the duration is not known
+        self.GuiBusy.setRange(0, 0)
+        self.GuiBusy.setTextVisible(False)
+        self.GuiCancel = RectButton('Cancel', self)
+        self.GuiCancel.move(480, 1)
+        self.GuiCancel.resize(60, 18)
+        self.GuiCancel.setToolTip('Cancel the running tasks')
+        self.hide()
+    
+    def setTasks(self, texts):
+        '''
+        texts --> list with the text of each running task
+        '''
+        if texts == []:
+            self.hide()
+        else:
+            self.GuiText.setText(', '.join(texts) + '...')
+            self.show()
+
+class FilterBar(QWidget):
+    '''
+    Row of small inputs placed above InstanceTable, which are
+    used to choose the filters of the instances (state, type,
+    tag, VPC, and zone). Their content is read with values(),
+    and the Apply button is exposed as self.GuiApply.
+    '''
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.resize(550, 22)
+        states = ['', 'pending', 'running', 'stopping', 'stopped',
+                  'shutting-down', 'terminated']
+        self.GuiState = ComboBoxWithUpdate(self, states)
+        self.GuiState.setToolTip('Instance State (empty for any)')
+        self.GuiState.move(15, 0)
+        self.GuiState.resize(95, 22)
+        self.GuiType = InputLine('', self)
+        self.GuiType.setPlaceholderText('Type, e.g. p3.*')
+        self.GuiType.move(115, 1)
+        self.GuiType.resize(QSize(85, 20))
+        self.GuiTag = InputLine('', self)
+        self.GuiTag.setPlaceholderText('Tag, e.g. Name=gpu')
+        self.GuiTag.move(205, 1)
+        self.GuiTag.resize(QSize(100, 20))
+        self.GuiVpc = InputLine('', self)
+        self.GuiVpc.setPlaceholderText('VPC Id')
+        self.GuiVpc.move(310, 1)
+        self.GuiVpc.resize(QSize(80, 20))
+        self.GuiZone = InputLine('', self)
+        self.GuiZone.setPlaceholderText('Zone')
+        self.GuiZone.move(395, 1)
+        self.GuiZone.resize(QSize(80, 20))
+        self.GuiApply = RectButton('Filter', self)
+        self.GuiApply.setToolTip('Show only the instances that match')
+        self.GuiApply.move(480, 0)
+        self.GuiApply.resize(QSize(55, 22))
+    
+    def values(self):
+        '''
+        Returns dict with the text of each input, using the
+        same keys as the arguments of InstanceFilter.
+        '''
+        return {'state': self.GuiState.currentText(),
+                'instanceType': self.GuiType.text(),
+                'tag': self.GuiTag.text(),
+                'vpcId': self.GuiVpc.text(),
+                'zone': self.GuiZone.text()}
+
+class InstanceModel(QtCore.QAbstractTableModel):
+    '''
+    Table model over the instances of the backend. Each row
+    is one entry of Backend.instancesData, and the text of
+    an item is only produced when the view asks for it (i.e.
+    when the row is visible).
+    
+    Changes are passed with applyDiff(), which emits the
+    fine-grained rowsRemoved, rowsInserted and dataChanged
+    signals, so that the view only repaints what changed.
+    
+    Instances for which the last action failed are passed
+    with setErrors(). Their rows are coloured, and the error
+    is shown as the tooltip of the row.
+    '''
+    def __init__(self, labels, parent = None):
+        super().__init__(parent)
+        self.labels = labels
+        self.columns = {}
+        for x in range(len(labels)):
+            self.columns[labels[x]] = x
+        # Instances shown on each row, their InstanceIds, and
+        # the row of each InstanceId.
+        self.rows = []
+        self.rowIds = []
+        self.rowOf = {}
+        # InstanceId --> error code of the last action
+        self.errors = {}
+    
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+    
+    def columnCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.labels)
+    
+    def data(self, index, role = QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return getattr(self.rows[index.row()],
+                           self.labels[index.column()])
+        if self.errors:
+            error = self.errors.get(self.rowIds[index.row()])
+            if error is None:
+                return None
+            if role == QtCore.Qt.ToolTipRole:
+                return 'Action failed: ' + error
+            if role == QtCore.Qt.BackgroundRole:
+                return QColor(255, 210, 210)
+        return None
+    
+    def headerData(self, section, orientation,
+                   role = QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole:
+            if orientation == QtCore.Qt.Horizontal:
+                return self.labels[section]
+            return str(section + 1)
+        return None
+    
+    def text(self, y, label):
+        '''Returns the text of row y in the column label'''
+        return getattr(self.rows[y], label)
+    
+    def setAll(self, data):
+        '''
+        data --> dict keyed by InstanceId, of which each entry
+        is an InstanceRecord (see DA_backend).
+        Replaces all rows of the model.
+        '''
+        self.beginResetModel()
+        self.rowIds = list(data.keys())
+        self.rows = list(data.values())
+        self.reindex()
+        self.endResetModel()
+    
+    def clear(self):
+        '''Removes all rows'''
+        self.setAll({})
+    
+    def reindex(self):
+        '''Recomputes the row of each InstanceId'''
+        self.rowOf = {}
+        for y in range(len(self.rowIds)):
+            self.rowOf[self.rowIds[y]] = y
+    
+    def applyDiff(self, diff):
+        '''
+        diff --> InstanceDiff (see DA_backend) between the
+        data of the model and the current one.
+        '''
+        root = QtCore.QModelIndex()
+        # Removes rows starting from the bottom, so that
+        # the indexes of the remaining ones do not move.
+        # Contiguous rows are removed together, with a single
+        # signal (e.g. when a filter hides most of the rows).
+        rows = []
+        for i in diff.removed:
+            if i in self.rowOf:
+                rows.append(self.rowOf[i])
+        rows.sort(reverse = True)
+        k = 0
+        while k < len(rows):
+            last = first = rows[k]
+            k += 1
+            while k < len(rows) and rows[k] == first - 1:
+                first = rows[k]
+                k += 1
+            self.beginRemoveRows(root, first, last)
+            del self.rows[first:last + 1]
+            del self.rowIds[first:last + 1]
+            self.endRemoveRows()
+        if rows:
+            self.reindex()
+        # Adds new instances, all at once, at the end. If a
+        # full refresh already added some of them, then those
+        # are only updated.
+        added = []
+        for i in diff.added:
+            if i in self.rowOf:
+                self.setRow(i, diff.instancesData[i], self.labels)
+            else:
+                added.append(i)
+        if added:
+            y = len(self.rows)
+            self.beginInsertRows(root, y, y + len(added) - 1)
+            for i in added:
+                self.rowOf[i] = len(self.rows)
+                self.rowIds.append(i)
+                self.rows.append(diff.instancesData[i])
+            self.endInsertRows()
+        # Updates the rows that changed
+        for i, labels in diff.changed.items():
+            if i in self.rowOf:
+                self.setRow(i, diff.instancesData[i], labels)
+    
+    def setErrors(self, errors):
+        '''
+        errors --> dict InstanceId --> error code, which
+        replaces the errors of the previous action.
+        '''
+        changed = set(self.errors) | set(errors)
+        self.errors = errors
+        for i in changed:
+            if i in self.rowOf:
+                y = self.rowOf[i]
+                self.dataChanged.emit(self.index(y, 0),
+                        self.index(y, len(self.labels) - 1))
+    
+    def setRow(self, i, d, labels):
+        '''
+        Replaces the entry of InstanceId i with d, and reports
+        that the items in the columns of labels changed.
+        '''
+        y = self.rowOf[i]
+        self.rows[y] = d
+        x = [self.columns[label] for label in labels]
+        if x:
+            self.dataChanged.emit(self.index(y, min(x)),
+                                  self.index(y, max(x)))
+
+class InstanceTable(QTableView):
+    '''
+    QTableView over an InstanceModel that also:
     1) takes list of labels in order to sets 
         HorizontalHearerLabels and ColumnCount.
     2) Defines refresh(), which uses given labels
         along with two dictionaries (inputs) to 
         contol what it shows.
-    3) Defines selectedRows(), which returns list of
-        selectedRows.
-    4) Defines totalClear(), which clears not only
+    3) Defines applyDiff(), which patches only the rows
+        and items that changed, keeping the selection.
+    4) Defines selectedRows() and selectedIds(), which
+        return the selected rows and their InstanceIds.
+    5) Defines setErrors(), which marks the rows of the
+        instances for which an action failed.
+    6) Defines totalClear(), which clears not only
         labels and content, but also sets columns and
         rows to zero.
     '''
@@ -292,11 +543,17 @@ class InstanceTable(QTableWidget):
                  view = None, data = None):
         super().__init__(parent)
         
-        # Stores labels and passes them to Headers
+        # Stores labels and passes them to the model
         self.labels = labels
         self.labelsCount = len(labels)
-        self.setColumnCount(self.labelsCount)
-        self.setHorizontalHeaderLabels(labels)
+        self.instanceModel = InstanceModel(labels, self)
+        self.setModel(self.instanceModel)
+        
+        # Rows have a fixed height, so that the view does
+        # not need to measure the content of every row.
+        self.verticalHeader().setSectionResizeMode(
+                                    QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(22)
         
         # Uses refresh to pass to the table the
         # content it is initialised with.
@@ -306,6 +563,11 @@ class InstanceTable(QTableWidget):
         # the table is not editable directly from the user.
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+    
+    @property
+    def rowIds(self):
+        '''InstanceId shown on each row'''
+        return self.instanceModel.rowIds
         
     def refresh(self, view = None, data = None):
         '''
@@ -314,9 +576,9 @@ class InstanceTable(QTableWidget):
         the corresponding collumn to be hidden.
                  If None, then no column is shown.
         
-        data --> list of which each entry is a dict with
-        the same keys as self.labels. Each dict is used
-        to populated one row.
+        data --> dict keyed by InstanceId, of which each
+        entry is an InstanceRecord (see DA_backend). Each
+        record is used to populated one row.
         
         If data is not given, then it only changes which
         collumns are hidden.
@@ -330,46 +592,29 @@ class InstanceTable(QTableWidget):
             for x in range(self.labelsCount):
                 self.setColumnHidden(
                     x, not view[self.labels[x]]) 
-        # Clears the table and loops through dictionaries
-        # contains in data to update the entries of the table.
+        # Replaces the content of the model
         if data is not None:
-            self.clearContents()
-            self.setRowCount(len(data))
-            y = 0
-            # loops through instances
-            for d in data:
-                # loops through labels
-                for x in range(self.labelsCount):
-                    item = QTableWidgetItem( 
-                            d[self.labels[x]] )
-                    self.setItem(y, x, item)
-                y += 1
-        else:
-             self.setRowCount(0)
-        # Ensures that GUI is updated.
-        self.update()
+            self.instanceModel.setAll(data)
     
-    def inplaceRefresh(self, data):
+    def applyDiff(self, diff):
         '''
-        Same with refresh but it updates the table items
-        instead of redefining the whole table. This does
-        not affect the rows that are currently selected.
+        diff --> InstanceDiff (see DA_backend) between the
+        data shown on the table and the current one.
+        
+        Removes and adds only the corresponding rows, and
+        changes only the items of the labels that changed.
+        This does not affect the rows that are currently
+        selected.
         '''
-        # If data does not match row count, then inplace
-        # Refresh was wrongly called and instead calls
-        # the refresh function.
-        if len(data) != self.rowCount():
-            self.refresh(self, view = None, data = data)
-        else:
-            y = 0
-            # loops through instances
-            for d in data:
-                # loops through labels
-                for x in range(self.labelsCount):
-                    self.item(y,x).setText(d[self.labels[x]])
-                y += 1
-            # Ensures that GUI is updated.
-            self.update()
+        self.instanceModel.applyDiff(diff)
+        
+    def setErrors(self, errors):
+        '''
+        errors --> dict InstanceId --> error code of the
+        instances for which the last action failed, which
+        are marked on the table.
+        '''
+        self.instanceModel.setErrors(errors)
         
     def selectedRows(self):
         '''
@@ -377,16 +622,21 @@ class InstanceTable(QTableWidget):
         [0,1] for first and second row, or [] if not row is
         selected.
         '''
-        # Obtains QObjects with the indexes of all selected
-        # items.
-        selectedItems = self.selectedIndexes()
-        # Uses .row on each item of selectedIndexes to get
-        # the row on which this item is.
+        # Obtains QModelIndex of the first column of every
+        # selected row, and uses .row on each to get the row.
         selectedRows = []
-        for item in selectedItems:
-            if item.row() not in selectedRows:
-                selectedRows.append(item.row())
-        return selectedRows
+        for item in self.selectionModel().selectedRows():
+            selectedRows.append(item.row())
+        return sorted(selectedRows)
+    
+    def selectedIds(self, sr = None):
+        '''
+        Returns list with the InstanceIds of the rows in 'sr'.
+        If sr is None, selectedRows is used.
+        '''
+        if sr is None:
+            sr = self.selectedRows()
+        return [self.rowIds[y] for y in sr]
     
     def RowsFilter(self, label, values, sr = None):
         '''
@@ -417,10 +667,9 @@ class InstanceTable(QTableWidget):
             return 'Error'
         else:
             out = []
-            x = self.labels.index(label)
             # Loops through rows
             for y in sr:
-                if self.item(y,x).text() in values:
+                if self.instanceModel.text(y, label) in values:
                     out.append(y)
             return out
         
@@ -429,8 +678,7 @@ class InstanceTable(QTableWidget):
         Clears content, sets all rows to zero, and
         hides all columns.
         '''
-        self.clearContents()
-        self.setRowCount(0)
+        self.instanceModel.clear()
         for x in range(self.labelsCount):
             self.setColumnHidden(x, True)
         
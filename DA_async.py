@@ -0,0 +1,243 @@
+'''
+Collection of classes used to call the backend without
+blocking, from asyncio or from the Qt event loop.
+'''
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import (QObject, pyqtSignal, pyqtSlot)
+
+class AsyncBackend():
+    '''
+    asyncio facade over Backend. Each method runs the blocking
+    method of Backend on its own pool of threads, and returns
+    the same result (e.g. 'NoError' or an error code).
+
+    At most limit calls run at once, and the rest wait on a
+    semaphore, so independent calls can be awaited together
+    (e.g. with asyncio.gather) without flooding AWS.
+
+    A call that is cancelled while it waits is never started.
+    Once it is running it can not be cancelled any more, as
+    threads can not be interrupted, and the change it makes
+    (on AWS or on the disk) happens anyway. So the cancel is
+    ignored, and its result is returned as usual, which lets
+    the caller apply it.
+    '''
+    def __init__(self, backend, limit = 4):
+        '''
+        backend --> Instance of Backend
+        limit --> maximum number of calls running at once
+        '''
+        self.backend = backend
+        self.limit = limit
+        # Not backend.executor, which get_instances and connect
+        # use themselves, and which could otherwise be filled
+        # by calls waiting on their own requests.
+        self.executor = ThreadPoolExecutor(max_workers = limit)
+        self._semaphore = None
+        # Tasks whose call is running
+        self.started = set()
+
+    async def call(self, method, *args, **kwargs):
+        '''
+        Runs method(*args, **kwargs) on self.executor, and
+        returns its result.
+        '''
+        # Created here, so that it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            task = asyncio.current_task()
+            self.started.add(task)
+            try:
+                future = loop.run_in_executor(self.executor,
+                        functools.partial(method, *args, **kwargs))
+                while True:
+                    try:
+                        return await asyncio.shield(future)
+                    except asyncio.CancelledError:
+                        # Too late, see the docstring of the class
+                        if future.cancelled():
+                            raise
+            finally:
+                self.started.discard(task)
+
+    async def connect(self, profile, region, callback = None):
+        return await self.call(self.backend.connect, profile, region,
+                               callback = callback)
+
+    async def get_instances(self, callback = None):
+        return await self.call(self.backend.get_instances,
+                               callback = callback)
+
+    async def act_instances(self, ids, act):
+        return await self.call(self.backend.act_instances, ids, act)
+
+    async def launch_instance(self, name, imageId, instanceType,
+                              keyPair, secGroup):
+        return await self.call(self.backend.launch_instance, name,
+                               imageId, instanceType, keyPair, secGroup)
+
+    async def create_key_pair(self, name):
+        return await self.call(self.backend.create_key_pair, name)
+
+    async def delete_key_pair(self, name):
+        return await self.call(self.backend.delete_key_pair, name)
+
+    async def create_security_group(self, Description, name, VpcId):
+        return await self.call(self.backend.create_security_group,
+                               Description, name, VpcId)
+
+    async def delete_security_group(self, name):
+        return await self.call(self.backend.delete_security_group,
+                               name)
+
+    def shutdown(self):
+        '''Lets the running calls finish, and drops the rest'''
+        self.executor.shutdown(wait = False)
+
+class QtAsyncBridge(QObject):
+    '''
+    Runs an asyncio event loop on a background thread, so that
+    the GUI can submit coroutines (e.g. of AsyncBackend) without
+    blocking. The result of each coroutine is passed to its
+    callback on the GUI thread, through the queued done signal.
+    '''
+    done = pyqtSignal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target = self.loop.run_forever,
+                                        daemon = True)
+        self._thread.start()
+        self.done.connect(self.deliver)
+
+    def submit(self, coro, callback = None):
+        '''
+        coro --> coroutine that runs on self.loop
+        callback --> function called on the GUI thread with
+                     the result of coro, 'Error' if it raised
+                     an exception, or 'Cancelled' if it was
+                     cancelled.
+        Returns the asyncio.Task of coro, which can be passed
+        to cancel.
+        '''
+        async def start():
+            task = asyncio.ensure_future(coro)
+            if callback is not None:
+                task.add_done_callback(
+                        lambda t: self.done.emit(callback, t))
+            return task
+        return asyncio.run_coroutine_threadsafe(start(),
+                                                self.loop).result()
+
+    @pyqtSlot(object, object)
+    def deliver(self, callback, future):
+        '''Calls callback with the result of future'''
+        if future.cancelled():
+            callback('Cancelled')
+        elif future.exception() is not None:
+            callback('Error')
+        else:
+            callback(future.result())
+
+    def cancel(self, task):
+        '''
+        Cancels a task returned by submit. It is only done
+        when the coroutine handles it (e.g. AsyncBackend.call
+        ignores it once its call runs).
+        '''
+        self.loop.call_soon_threadsafe(task.cancel)
+
+    def shutdown(self):
+        '''Stops the loop and its thread'''
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(1)
+
+class TaskRunner(QObject):
+    '''
+    Runs the blocking actions of the GUI (connect, start/stop
+    instances, launch, key pairs, ...) in the background, with
+    an AsyncBackend driven by a QtAsyncBridge. It keeps the
+    text of each running task, so that a progress indicator can
+    show them, and they can be cancelled.
+    '''
+    # Emits the list with the text of the running tasks
+    # (empty when all of them finished).
+    progress = pyqtSignal(list)
+
+    def __init__(self, backend, limit = 4):
+        '''
+        backend --> Instance of Backend
+        limit --> maximum number of tasks running at once
+        '''
+        super().__init__()
+        self.async_backend = AsyncBackend(backend, limit)
+        self.bridge = QtAsyncBridge()
+        # future --> text of the task
+        self.tasks = {}
+
+    def run(self, text, coro, callback = None):
+        '''
+        text --> str shown while the task runs
+        coro --> coroutine, e.g. of self.async_backend
+        callback --> function called on the GUI thread with
+                     the result (see QtAsyncBridge.submit)
+        Returns the task (see QtAsyncBridge.submit).
+        '''
+        future = self.bridge.submit(coro,
+                    lambda result: self.finish(future, result, callback))
+        self.tasks[future] = text
+        self.progress.emit(list(self.tasks.values()))
+        return future
+
+    def call(self, text, function, *args, callback = None, **kwargs):
+        '''
+        Same as run, for any blocking function(*args, **kwargs).
+        '''
+        return self.run(text,
+                self.async_backend.call(function, *args, **kwargs),
+                callback)
+
+    def finish(self, future, result, callback):
+        '''Called on the GUI thread when a task finishes'''
+        self.tasks.pop(future, None)
+        self.progress.emit(list(self.tasks.values()))
+        if callback is not None:
+            callback(result)
+
+    def cancel(self, future):
+        '''
+        Cancels one task, if its call has not started yet.
+        Otherwise the task finishes, and its callback gets the
+        result, which has to be applied anyway. Returns True
+        if the task was cancelled.
+        '''
+        if future in self.async_backend.started:
+            if future in self.tasks and \
+                    not self.tasks[future].endswith(' (finishing)'):
+                self.tasks[future] += ' (finishing)'
+                self.progress.emit(list(self.tasks.values()))
+            return False
+        self.bridge.cancel(future)
+        return True
+
+    @pyqtSlot()
+    def cancelAll(self):
+        '''Cancels all the tasks that have not started yet'''
+        for future in list(self.tasks):
+            self.cancel(future)
+
+    def isRunning(self):
+        '''Returns True if some task is running'''
+        return self.tasks != {}
+
+    def shutdown(self):
+        '''Cancels the tasks and stops the background loop'''
+        self.cancelAll()
+        self.async_backend.shutdown()
+        self.bridge.shutdown()
@@ -2,9 +2,58 @@
 Collection of classes used to handle backend processing.
 '''
 import pickle
-import boto3
+import json
 import os
-from botocore.exceptions import ClientError
+import atexit
+import re
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from DA_clients import (client_pool, SingleFlight, THROTTLE_ERRORS,
+                        USER, BACKGROUND)
+from DA_storage import Store
+
+# Entries of the regions and profiles lists used to connect
+# to all regions, or with all profiles, at once.
+ALL_REGIONS = 'All Regions'
+ALL_PROFILES = 'All Profiles'
+
+# Lists requested by connect, next to the instances, as
+# attribute of Backend --> [describe method, response key, item key]
+METADATA = {
+    'key_pairs': ['describe_key_pairs', 'KeyPairs', 'KeyName'],
+    'security_groups': ['describe_security_groups',
+                        'SecurityGroups', 'GroupName'],
+    'Vpcs': ['describe_vpcs', 'Vpcs', 'VpcId']}
+
+# Actions on instances --> [client method, response key with
+# the new state of each instance (None if there is none)]
+ACTIONS = {
+    'start': ['start_instances', 'StartingInstances'],
+    'stop': ['stop_instances', 'StoppingInstances'],
+    'reboot': ['reboot_instances', None],
+    'terminate': ['terminate_instances', 'TerminatingInstances']}
+
+# Maximum number of instances per request of act_instances.
+# Smaller chunks keep one failing instance from delaying the
+# rest, and stay below the limits of AWS.
+ACT_CHUNK = 100
+
+# States in which an instance is changing, which are polled
+# by poll_transitions between the full updates.
+TRANSITION_STATES = ['pending', 'stopping', 'shutting-down']
+
+# Maximum number of InstanceIds per describe_instances
+# request of poll_transitions.
+POLL_CHUNK = 200
+
+# Error codes of a request that do not depend on its
+# instances, so act_chunk does not split it to retry.
+# Throttled requests (see DA_clients) are reported as
+# 'Throttled'.
+ACT_REQUEST_ERRORS = ['AuthFailure', 'UnauthorizedOperation',
+                      'OptInRequired', 'Blocked'] + THROTTLE_ERRORS
 
 class Backend():
     '''
@@ -14,9 +63,8 @@ class Backend():
         # Attempts to retrive user_data. If not possible,
         # it initialises them with empty/default values.
         self.user_data = User_Data()
-        # Attemps to update list of AWS regions that
-        # support EC2 instances.
-        self.user_data.update_regions()
+        # The saved list of AWS regions is used at start up,
+        # and it is updated later by discover_regions.
         
         # placeholder for the AWS session/client which will
         # connect the backend instance with the AWS server.
@@ -29,6 +77,17 @@ class Backend():
         self.used_profile = None
         self.used_region = None
         
+        # Targets, i.e. [profile, region], from which the
+        # instances are requested. There are more than one in
+        # the ALL_REGIONS and ALL_PROFILES modes, where each
+        # target gets its own client from the shared client_pool
+        # and the requests run on a bounded pool of threads.
+        # target_reports keeps the latency and error of the
+        # last request to each target.
+        self.targets = []
+        self.target_reports = {}
+        self.executor = ThreadPoolExecutor(max_workers = 8)
+        
         # placeholders for arrays which will store the
         # names of available key-pairs and security groups.
         # key_pairs_files stores all the key pair, so that
@@ -38,92 +97,298 @@ class Backend():
         self.security_groups = []
         self.Vpcs = []
         
-        # placehorders for instancesData as returned by boto3
-        # describe_instances and a smaller version of it
-        # that is used to build the corresponding GUI table.
-        self.instancesDataBig = []
-        self.instancesData = [self.emptyInstanceData()]
+        # Increases on each connect/disconnect, so that lists
+        # requested by an older connect are dropped. 
+        # connect_timings stores the seconds, since connect
+        # was called (at connect_started), at which each request
+        # finished, and 'instances' when the first update of
+        # all the targets finished (i.e. the time to usable).
+        self.connect_id = 0
+        self.connect_started = 0
+        self.connect_timings = {}
+        # Lists of previous connects, shown while they are
+        # requested again.
+        self.metadata_cache = MetadataCache(self.user_data.store)
+        
+        # placehorder for the smaller version of boto3
+        # describe_instances that is used to build the
+        # corresponding GUI table. It is a dict of
+        # InstanceRecords keyed by InstanceId, which keeps
+        # the order of the table.
+        self.instancesData = {}
         
-    def connect(self, profile, region):
+        # InstanceFilter that is passed to AWS when the
+        # instances are requested.
+        self.instance_filter = InstanceFilter()
+        
+        # Instances in a transition state, which are polled
+        # more often than the rest (see poll_transitions).
+        self.transitions = TransitionTracker()
+        
+        # Time at which AWS last throttled a request of
+        # get_instances or poll_transitions (see isThrottled).
+        self.throttled_at = 0
+        
+        # Concurrent calls of get_instances share a single
+        # update. instances_lock is held while
+        # self.instancesData changes (updates, actions and
+        # disconnect), but not while requests run.
+        self.flights = SingleFlight()
+        self.instances_lock = threading.RLock()
+        
+    def connect(self, profile, region, callback = None):
         '''
         profile -> str with the name of the profile which will
-                   be used to connect with the AWS server.
+                   be used to connect with the AWS server, or
+                   ALL_PROFILES.
+        region -> str with the region, or ALL_REGIONS.
+        callback -> function called as callback(name, error)
+                    when each of the METADATA lists is ready,
+                    where error is 'NoError' or 'DescribeError'.
+                    It is called from a thread of self.executor.
         1.  Finds credentials corresponding to profile
         2.  Validates credentials by requesting list of regions
             that support EC2 instances.
         3.  If profile exists and credentials are valid, then 
-            sets self.sess = boto3.Session(), and similarly
-            for the self.client. It also returns 'NoError'
-        4.  Otherwise, returns error from AWS.
+            sets self.sess to the pooled session, and similarly
+            for the self.client. 
+        4.  Requests the key pairs, security groups and Vpcs
+            on self.executor, and returns 'NoError' at once,
+            while they keep loading. The instances are not
+            requested here. The first get_instances (e.g. of the
+            refresher) fills them, and its callback shows each
+            target as soon as it is ready, so a slow region does
+            not hold back the others.
+        5.  Otherwise, returns error from AWS.
+        
+        With ALL_PROFILES or ALL_REGIONS, the main session and
+        client (used for key pairs, security groups, launching,
+        ...) use the first profile and a single home region,
+        while the instances are requested from every target.
         '''
+        start = time.perf_counter()
         # Attempts to find credentials. If it fails
         # returns errors.
-        if profile != '':
+        if profile == ALL_PROFILES:
+            profiles = list(self.user_data.profile)
+        elif profile != '':
+            profiles = [profile]
+        else:
+            profiles = []
+        if profiles != []:
+            profile = profiles[0]
             credentials = self.user_data.pass_credentials(profile)
             if credentials is not None:
-                # Defines session with retrived credentials
-                self.sess = boto3.Session(
-                    aws_access_key_id = credentials[0], 
-                    aws_secret_access_key = credentials[1],
-                    region_name = region
-                )
-                self.client = self.sess.client('ec2')
-                self.get_instances()
+                if region == ALL_REGIONS:
+                    regions = list(self.user_data.ec2_regions)
+                    region = self.user_data.home_region()
+                else:
+                    regions = [region]
                 try:
-                    # Requests list of regions. If it fails
-                    # moves to 'ConnectionError'.
-                    self.client.describe_regions()
-                    try:
-                        # Attempts to update attributes. If it
-                        # fails move to 'DescribeError'
-                        self.user_data.save()
-                        self.get_key_pairs()
-                        self.get_security_groups()
-                        self.get_Vpcs()
-                        
-                        # If successful updates self.used_
-                        # and returns 'NoError'
-                        self.used_profile = profile
-                        self.used_region = region
-                        self.user_data.default_region = region
-                        return 'NoError'
-                    except:
-                        self.sess = None
-                        self.client = None
-                        return 'DescribeError'
-                except:
-                    self.sess = None
-                    self.client = None
+                    # Defines session with retrived credentials,
+                    # and requests list of regions. If it fails
+                    # moves to 'ConnectionError', or 'Throttled'
+                    # if AWS kept throttling it.
+                    self.sess = self.get_session(profile)
+                    self.client = self.get_client(profile, region)
+                    responce = self.client.describe_regions()
+                except Exception as e:
+                    self.disconnect()
+                    # ClientError of botocore has the response
+                    if hasattr(e, 'response') and \
+                            e.response['Error']['Code'] in THROTTLE_ERRORS:
+                        return 'Throttled'
                     return 'ConnectionError'
+                # The same request refreshes the list of regions
+                self.user_data.set_regions(responce)
+                self.connect_id += 1
+                self.connect_started = start
+                self.connect_timings = {
+                        'validate': time.perf_counter() - start}
+                self.used_profile = profile
+                self.used_region = region
+                self.targets = []
+                for p in profiles:
+                    for r in regions:
+                        self.targets.append((p, r))
+                # Clients of the targets are used on every refresh
+                client_pool.pin(self.targets)
+                # Cached lists are shown at once. Only the stale
+                # ones are requested again.
+                for name in METADATA:
+                    values, fresh = self.metadata_cache.get(
+                                        (profile, region), name)
+                    setattr(self, name, list(values or []))
+                    if not fresh:
+                        self.executor.submit(self.fetch_metadata,
+                                name, self.client, (profile, region),
+                                self.connect_id, start, callback)
+                # AMI names are resolved in the background too
+                names, fresh = self.cached_AmiNames()
+                if not fresh:
+                    self.executor.submit(self.resolve_AmiNames,
+                            self.client, region, names,
+                            self.connect_id, callback)
+                if len(regions) == 1:
+                    self.user_data.default_region = region
+                try:
+                    self.user_data.save('ec2_regions', 'default_region')
+                except:
+                    pass
+                return 'NoError'
             else:
                 return 'WrongCredentials'
         else:
             return 'NoAccessKey'
     
+    def fetch_metadata(self, name, client, target, connect_id,
+                       start, callback = None):
+        '''
+        Requests the list name of METADATA with client and
+        stores it in self.metadata_cache. If it is different
+        from the shown one, and no new connect or disconnect
+        happened meanwhile, it replaces it and calls
+        callback(name, error).
+        '''
+        try:
+            values = self.describe_metadata(name, client)
+        except:
+            if connect_id == self.connect_id and callback is not None:
+                callback(name, 'DescribeError')
+            return
+        self.metadata_cache.put(target, name, values)
+        if connect_id != self.connect_id:
+            return
+        self.connect_timings[name] = time.perf_counter() - start
+        if values != getattr(self, name):
+            setattr(self, name, values)
+            if callback is not None:
+                callback(name, 'NoError')
+    
+    def cache_metadata(self, name):
+        '''
+        Stores the list name (e.g. after creating a key pair)
+        in self.metadata_cache.
+        '''
+        if self.client is not None:
+            self.metadata_cache.put((self.used_profile,
+                    self.used_region), name, list(getattr(self, name)))
+    
+    def cached_AmiNames(self):
+        '''
+        Sets the names of user_data.ImageIds to the ones
+        cached for the used region, as AMI ids are regional.
+        Returns [names, fresh], where names is the cached dict
+        {ImageId: name} (empty if it is stale), and fresh is
+        False if some of the ImageIds are missing.
+        '''
+        names, fresh = self.metadata_cache.get(('', self.used_region),
+                                               'ImageNames')
+        names = dict(names or {})
+        u = self.user_data
+        u.ImageNames = [names.get(i, '') for i in u.ImageIds]
+        if not fresh:
+            return [{}, False]
+        for i in u.ImageIds:
+            if i not in names:
+                fresh = False
+        return [names, fresh]
+    
+    def resolve_AmiNames(self, client, region, names, connect_id,
+                         callback = None):
+        '''
+        Requests the names of user_data.ImageIds that are not
+        in names with a single batched describe_images, and
+        stores them in
+        self.metadata_cache. Then, if no new connect happened,
+        updates user_data.ImageNames and calls
+        callback('ImageNames', 'NoError'). Errors are ignored,
+        as some AMIs may not exist depending on the region.
+        '''
+        u = self.user_data
+        try:
+            missing = [i for i in u.ImageIds if i not in names]
+            names.update(u.describe_AmiNames(client, missing))
+        except:
+            return
+        self.metadata_cache.put(('', region), 'ImageNames', names)
+        if connect_id == self.connect_id:
+            u.ImageNames = [names.get(i, '') for i in u.ImageIds]
+            u.save('ImageNames')
+            if callback is not None:
+                callback('ImageNames', 'NoError')
+    
+    def add_AMI(self, imageId):
+        '''
+        Uses user_data.add_AMI with self.client, and caches
+        the name for the used region.
+        '''
+        error = self.user_data.add_AMI(imageId, self.client)
+        if error == 'NoError':
+            names = self.metadata_cache.get(('', self.used_region),
+                                            'ImageNames')[0]
+            names = dict(names or {})
+            names[imageId] = self.user_data.ImageNames[-1]
+            self.metadata_cache.put(('', self.used_region),
+                                    'ImageNames', names)
+        return error
+    
+    def describe_metadata(self, name, client = None):
+        '''
+        Returns the list name of METADATA, requested with
+        client (self.client by default).
+        '''
+        if client is None:
+            client = self.client
+        method, key, item = METADATA[name]
+        response = getattr(client, method)()
+        return [i[item] for i in response[key]]
+    
+    def discover_regions(self, callback = None):
+        '''
+        Imports boto3 and, only if the saved list is stale,
+        updates the list of AWS regions that support EC2
+        instances on self.executor, so that neither delays the
+        main window from showing up. callback() is called
+        from that thread when it finishes.
+        '''
+        def discover():
+            import boto3
+            # Does not hold back the requests of the user
+            client_pool.set_priority(BACKGROUND)
+            try:
+                self.user_data.update_regions()
+            finally:
+                client_pool.set_priority(USER)
+            if callback is not None:
+                callback()
+        return self.executor.submit(discover)
+    
     def disconnect(self):
         '''
         Sets all sesssion related variables but to
         the logged out state.
         '''
-        self.sess = None
-        self.client = None
-        self.used_profile = None
-        self.used_region = None
-        self.key_pairs = []
-        self.security_groups = []
-        self.Vpcs = []
-        self.instancesDataBig = []
-        self.instancesData = [self.emptyInstanceData()]
+        with self.instances_lock:
+            self.connect_id += 1
+            self.sess = None
+            self.client = None
+            self.used_profile = None
+            self.used_region = None
+            self.targets = []
+            self.target_reports = {}
+            self.key_pairs = []
+            self.security_groups = []
+            self.Vpcs = []
+            self.instancesData = {}
+            self.transitions = TransitionTracker()
+        client_pool.pin([])
     
     def get_key_pairs(self):
         '''
         Obtains list of key pairs on AWS server.
         '''
-        KeyPairNames = []
-        response = self.client.describe_key_pairs()
-        for i in response['KeyPairs']:
-            KeyPairNames.append(i['KeyName'])
-        self.key_pairs = KeyPairNames
+        self.key_pairs = self.describe_metadata('key_pairs')
     
     def get_key_pairs_local(self):
         '''
@@ -150,22 +415,14 @@ class Backend():
         Obtains list of security groups associated with used
         credentials and regions.
         '''
-        SecurityGroups = []
-        response = self.client.describe_security_groups()
-        for i in response['SecurityGroups']:
-            SecurityGroups.append(i['GroupName'])
-        self.security_groups = SecurityGroups
+        self.security_groups = self.describe_metadata('security_groups')
     
     def get_Vpcs(self):
         '''
         Obtains list of Vpcs associated with used
         credentials and regions.
         '''
-        Vpcs = []
-        response = self.client.describe_vpcs()
-        for i in response['Vpcs']:
-            Vpcs.append(i['VpcId'])
-        self.Vpcs = Vpcs
+        self.Vpcs = self.describe_metadata('Vpcs')
     
     def create_key_pair(self, name):
         '''
@@ -183,8 +440,9 @@ class Backend():
             #try:
             KeyPair = self.client.create_key_pair(KeyName = name)
             self.user_data.key_pairs_files.append(KeyPair)
-            self.user_data.save()
+            self.user_data.save('key_pairs_files')
             self.key_pairs.append(name)
+            self.cache_metadata('key_pairs')
             self.export_key_pair(name)
             return 'NoError'
             #except:
@@ -200,6 +458,7 @@ class Backend():
             i = self.key_pairs.index(name)
             del self.key_pairs[i]
             self.client.delete_key_pair(KeyName = name)
+            self.cache_metadata('key_pairs')
         except:
             pass
         for i in self.user_data.key_pairs_files:
@@ -250,6 +509,7 @@ class Backend():
                         GroupName=name,
                         VpcId=VpcId)  
                 self.security_groups.append(name)
+                self.cache_metadata('security_groups')
                 return 'NoError'
             except:
                 return 'Error'
@@ -266,189 +526,507 @@ class Backend():
                 i = self.security_groups.index(name)
                 del self.security_groups[i]
                 self.client.delete_security_group(GroupName = name)
+                self.cache_metadata('security_groups')
                 return 'NoError'
             except:
                 return 'Error'
     
-    def emptyInstanceData(self):
-        '''
-        Returns a dictionary with the elements found in self.instancesData
-        all set to ''
-        '''
-        d ={'InstanceName': '',
-            'InstanceId' : '',
-            'InstanceState' : '',
-            'InstanceType' : '',
-            'StatusCheck' : '',
-            'AvailabilityZone' : '',
-            'SecurityGroupId' : '',
-            'SecurityGroupName': '',
-            'ImageId' : '',
-            'KeyName' : '',
-            'PublicDns' : '',
-            'PublicIp' : '',
-            'PrivateDns' : '',
-            'PrivateIp' : '',
-            'VpcId' : '',
-            'SubnetId' : ''}
-        return d
+    def get_status_checks(self, client, Filters = None):
+        '''
+        Returns dict that maps the InstanceId of every running
+        instance to the text shown in the StatusCheck column.
+        
+        The statuses of the whole region are requested with a
+        single (paginated) describe_instance_status call, so the
+        number of calls does not grow with the number of instances.
+        
+        Filters --> list of filters, as given by
+                    InstanceFilter.statusFilters()
+        '''
+        statusChecks = {}
+        kwargs = {'IncludeAllInstances': True,
+                  'MaxResults': 1000}
+        if Filters:
+            kwargs['Filters'] = Filters
+        while True:
+            r = client.describe_instance_status(**kwargs)
+            for s in r['InstanceStatuses']:
+                if s['InstanceState']['Name'] == 'running':
+                    InstanceTest = s['InstanceStatus']['Status'] == 'ok'
+                    SystemTest = s['SystemStatus']['Status'] == 'ok'
+                    if InstanceTest and SystemTest:
+                        statusChecks[s['InstanceId']] = '2/2 checks passed'
+                    else:
+                        statusChecks[s['InstanceId']] = 'Initializing'
+            # Continues to the next page, if there is one
+            if r.get('NextToken'):
+                kwargs['NextToken'] = r['NextToken']
+            else:
+                return statusChecks
+    
+    def iter_instances(self, client, statusChecks = None,
+                       Filters = None, tags = True,
+                       target = ('', ''), InstanceIds = None):
+        '''
+        Generator that walks through every page of boto3 -->
+        describe_instances (using NextToken) and yields one
+        InstanceRecord for every instance of every reservation.
+        
+        statusChecks --> dict as returned by get_status_checks,
+                        used to fill the StatusCheck entries.
+                        If None, those are left empty.
+        Filters --> list of filters, as given by
+                    InstanceFilter.instanceFilters()
+        tags --> if False, InstanceName is not resolved
+        target --> [profile, region] saved as the Profile and
+                    Region of every instance
+        InstanceIds --> if given, only these instances are
+                        requested
+        
+        Only the current page is kept in memory, so the caller
+        can consume the instances as they arrive.
+        '''
+        # AWS does not accept MaxResults with InstanceIds
+        if InstanceIds:
+            kwargs = {'InstanceIds': InstanceIds}
+        else:
+            kwargs = {'MaxResults': 1000}
+        if Filters:
+            kwargs['Filters'] = Filters
+        while True:
+            page = client.describe_instances(**kwargs)
+            # One record for every instance of every
+            # reservation of the page.
+            yield from InstanceRecord.fromReservations(
+                    page['Reservations'], statusChecks, tags, target)
+            # Continues to the next page, if there is one
+            if page.get('NextToken'):
+                kwargs['NextToken'] = page['NextToken']
+            else:
+                return
+    
+    def get_session(self, profile):
+        '''
+        Returns the boto3 session of the given profile, as
+        cached by client_pool.
+        '''
+        return client_pool.session(
+                profile, self.user_data.pass_credentials(profile))
+    
+    def get_client(self, profile, region):
+        '''
+        Returns the client of the given profile and region, as
+        cached by client_pool.
+        '''
+        return client_pool.client(
+                profile, region,
+                self.user_data.pass_credentials(profile))
+    
+    def target_name(self, target, targets = None):
+        '''
+        Returns the str used for target ([profile, region])
+        in self.target_reports. targets is the list of targets
+        it belongs to (self.targets if None).
+        '''
+        if targets is None:
+            targets = self.targets
+        if targets and targets[0][0] != targets[-1][0]:
+            return target[0] + ' ' + target[1]
+        return target[1]
+    
+    def fetch_target(self, client, target):
+        '''
+        Uses iter_instances to request the instances of one
+        target ([profile, region]), using the given client.
+        Returns [instancesData, latency, error], where
+        instancesData is a dict of InstanceRecords keyed by
+        InstanceId (None if it failed), latency is in sec, and
+        error is '' or the error code.
+        '''
+        # botocore is only imported once a client exists
+        from botocore.exceptions import ClientError
+        start = time.time()
+        try:
+            # The filters are applied by AWS, so only the
+            # instances that match them are downloaded, and the
+            # plan skips what the visible columns do not need.
+            f = self.instance_filter
+            plan = FetchPlan(self.user_data.InstanceView, f)
+            if plan.statusChecks:
+                statusChecks = self.get_status_checks(
+                                    client, f.statusFilters())
+            else:
+                statusChecks = None
+            instancesData = {}
+            for d in self.iter_instances(client, statusChecks,
+                                         f.instanceFilters(),
+                                         plan.tags, target):
+                instancesData[d.InstanceId] = d
+            return [instancesData, time.time() - start, '']
+        except ClientError as e:
+            return [None, time.time() - start,
+                    e.response['Error']['Code']]
+        except:
+            return [None, time.time() - start, 'ConnectionError']
+    
+    def iter_targets(self, targets):
+        '''
+        Generator that requests the instances of all the given
+        targets, and yields [target, result] as soon as each
+        one is ready, where result is given by fetch_target.
+        If there are many targets, they run concurrently on
+        self.executor, so a slow one does not delay others.
+        '''
+        clients = {}
+        for target in targets:
+            clients[target] = self.get_client(*target)
+        if len(targets) == 1:
+            target = targets[0]
+            yield [target, self.fetch_target(clients[target], target)]
+        else:
+            futures = {}
+            for target in targets:
+                f = self.executor.submit(self.fetch_target,
+                                         clients[target], target)
+                futures[f] = target
+            for f in as_completed(futures):
+                yield [futures[f], f.result()]
+    
+    def merge_target(self, target, instancesData):
+        '''
+        Replaces the instances of the given target in
+        self.instancesData, and returns the InstanceDiff.
+        Instances that existed before keep their position,
+        and new ones are added at the end.
+
+        Profiles of the same account see the same instances,
+        which are kept by the first target that reported them.
+        '''
+        shown = self.instancesData
+        instancesData = {i: d for i, d in instancesData.items()
+                         if i not in shown or shown[i].target() == target}
+        old = {}
+        for i, d in self.instancesData.items():
+            if d.target() == target:
+                old[i] = d
+        diff = InstanceDiff(old, instancesData)
+        ordered = {}
+        for i, d in self.instancesData.items():
+            if d.target() != target:
+                ordered[i] = d
+            elif i in instancesData:
+                ordered[i] = instancesData[i]
+        for i in diff.added:
+            ordered[i] = instancesData[i]
+        self.instancesData = ordered
+        return diff
     
-    def get_instances(self, client = None):
+    def get_instances(self, client = None, callback = None):
         '''
-        Saves the response of boto3 --> describe_instances,
-        and it also creates a smaller verion of it that is
-        used to build the GUI instance table.
+        Uses iter_instances to create the smaller version of
+        boto3 --> describe_instances that is used to build the
+        GUI instance table. The instances are consumed page by
+        page, and the raw response is not kept.
         
         If client is given, it uses this client to obtain
-        the list with the Instances Attributes and returns it.
+        the dict with the Instances Attributes and returns it.
         
         If client is not given, but self.sess exists (logged in)
-        the uses self.client to get the list, and saves it in
-        self.instancesData.
+        it requests the instances of every target in
+        self.targets, saves them in self.instancesData, and
+        returns an InstanceDiff with what changed since the
+        previous update. If callback is given, it is called
+        with the InstanceDiff of each target as soon as this
+        target is ready. The latency and error of each target
+        are saved in self.target_reports.
         
-        If neither, then it return 'NoClient'
+        If neither, then it return 'NoClient'. If all targets
+        fail, then it returns 'Error'. Targets on which AWS
+        throttled the request report the error 'Throttled'.
         
-        If InstanceIds are different from the
-        previous update, then return 'InstanceChange'.
-        If InstanceIds are the same, but other entries
-        changed, then returns 'AttributeChange'.
-        If neither, then returns 'NoChange'.
+        If an update is already running (e.g. from the refresher
+        and from connect), the call waits for it and returns
+        its InstanceDiff, which is passed whole to callback.
         '''
-        old_instancesData = self.instancesData
-        error = False
-        instancesDataBig = None
         if client is not None:
-            try:
-                # Saves response as given by AWS
-                instancesDataBig = client.describe_instances()
-            except:
-                error = True
-        elif self.sess is not None:
-            try:
-                # Saves response as given by AWS
-                self.instancesDataBig = self.client.describe_instances()
-                instancesBig = self.instancesDataBig
-            except:
-                error = True
+            instancesData, latency, error = self.fetch_target(
+                    client, (self.used_profile, self.used_region))
+            if error != '':
+                return 'Error'
+            return instancesData
+        elif self.sess is None:
+            return 'NoClient'
         
-        if error:
-            return 'Error'
-        elif instancesBig is None:
+        ran = []
+        def update():
+            ran.append(True)
+            return self.update_instances(callback)
+        diff = self.flights.do(('get_instances', tuple(self.targets)),
+                               update)
+        if not ran and callback is not None and \
+                not isinstance(diff, str) and not diff.isEmpty():
+            callback(diff)
+        return diff
+    
+    def update_instances(self, callback = None):
+        '''
+        Part of get_instances, which requests the instances of
+        every target and updates self.instancesData.
+        '''
+        # disconnect (on the GUI thread) may replace the targets
+        # meanwhile, so the update uses its own copy, and stops
+        # as soon as the connection changes.
+        targets = list(self.targets)
+        connect_id = self.connect_id
+        if targets == []:
             return 'NoClient'
+        diff = InstanceDiff({}, {})
+        failed = 0
+        for target, result in self.iter_targets(targets):
+            instancesData, latency, error = result
+            if error in THROTTLE_ERRORS:
+                error = 'Throttled'
+                self.throttled_at = time.time()
+            # The lock is only held while self.instancesData
+            # changes, not while the requests run.
+            with self.instances_lock:
+                if self.connect_id != connect_id:
+                    return 'NoClient'
+                self.target_reports[self.target_name(target, targets)] = {
+                        'latency': latency, 'error': error}
+                # Instances of a target that failed are kept
+                if error != '':
+                    failed += 1
+                    continue
+                d = self.merge_target(target, instancesData)
+            diff.extend(d)
+            if callback is not None and not d.isEmpty():
+                callback(d)
+        if failed == len(targets):
+            return 'Error'
+        with self.instances_lock:
+            if self.connect_id == connect_id and \
+                    'instances' not in self.connect_timings:
+                self.connect_timings['instances'] = \
+                        time.perf_counter() - self.connect_started
+        return diff
+    
+    def poll_transitions(self, callback = None):
+        '''
+        Requests only the instances that are in one of the
+        TRANSITION_STATES (e.g. after a start or stop), and
+        whose turn has come according to self.transitions, with
+        describe_instances(InstanceIds = ...). The number of
+        requests depends on the number of instances that are
+        changing, not on the total number of instances.
+        
+        Updates self.instancesData and returns the InstanceDiff.
+        Instances that are not returned any more (i.e. they no
+        longer match self.instance_filter) are removed. If
+        callback is given, it is called with the InstanceDiff
+        of each request that changed something.
+        '''
+        diff = InstanceDiff({}, {})
+        if self.sess is None:
+            return diff
+        # The lock is only held while self.instancesData is
+        # read or changes, not while the requests run.
+        with self.instances_lock:
+            connect_id = self.connect_id
+            self.transitions.update(self.instancesData)
+            due = self.transitions.due()
+            # Groups the instances by target
+            targetIds = {}
+            for i in due:
+                if i in self.instancesData:
+                    target = self.instancesData[i].target()
+                    targetIds.setdefault(target, []).append(i)
+        if targetIds == {}:
+            return diff
+        # In chunks of POLL_CHUNK. The clients are created on
+        # this thread, so that they get its priority (see
+        # DA_clients).
+        chunks = []
+        for target, ids in targetIds.items():
+            client = self.get_client(*target)
+            for k in range(0, len(ids), POLL_CHUNK):
+                chunks.append([target, client, ids[k:k+POLL_CHUNK]])
+        if len(chunks) == 1:
+            results = [self.poll_chunk(*chunks[0])]
         else:
-            instancesData = []
-            # Loops through the entry for each instance
-            for y in self.instancesDataBig['Reservations']:
-                # Defines dict which temporarily stores the values as
-                # they are extracted from instancesBig
-                d = self.emptyInstanceData()
-                # Defines i to shorten notation
-                i = y['Instances'][0]
-                # 'Tags' only exists if a tag has been
-                # created. If not InstanceName = ''
-                try:
-                    # If Tags exist, loops until it finds
-                    # Tag with Key = 'Name'. If not uses
-                    # the first Tag for InstanceName.
-                    k = 0
-                    while k < len(i['Tags']):
-                        if i['Tags'][k]['Key'] == 'Name':
-                            d['InstanceName'] = i['Tags'][k]['Value']
-                            k = len(i['Tags']) + 1
-                        else:
-                            k += 1 
-                    if k == len(i['Tags']):
-                        d['InstanceName'] = i['Tags'][k]['Value']
-                except:
-                    d['InstanceName'] = ''
-                # Fills the rest of the entries
-                d['InstanceId'] = i['InstanceId']
-                d['InstanceState'] = i['State']['Name']
-                d['InstanceType'] = i['InstanceType']
-                d['AvailabilityZone'] = i['Placement']['AvailabilityZone']
-                if i['SecurityGroups'] != []:
-                    d['SecurityGroupId'] = i['SecurityGroups'][0]['GroupId']
-                    d['SecurityGroupName'] = i['SecurityGroups'][0]['GroupName']
-                d['ImageId'] = i['ImageId']
-                if 'KeyName' in i.keys():
-                    d['KeyName'] = i['KeyName']
-                d['PublicDns'] = i['PublicDnsName']
-                # Some keys do not always exist
-                if 'PublicIpAddress' in i.keys():
-                    d['PublicIp'] = i['PublicIpAddress']
-                if 'PrivateIpAddress' in i.keys():
-                    d['PrivateIp'] = i['PrivateIpAddress']
-                if 'VpcId' in i.keys():
-                    d['VpcId'] = i['VpcId']
-                if 'SubnetId' in i.keys():
-                    d['SubnetId'] = i['SubnetId']
-                # Gets status report
-                if d['InstanceState'] == 'running':
-                    if client is not None:
-                        r = client.describe_instance_status(
-                            InstanceIds=[d['InstanceId']])
-                    elif self.sess is not None:
-                        r = self.client.describe_instance_status(
-                            InstanceIds=[d['InstanceId']])
-                    InstanceTest = \
-                    r['InstanceStatuses'][0]['InstanceStatus']['Status']=='ok' 
-                    SystemTest = \
-                    r['InstanceStatuses'][0]['SystemStatus']['Status']=='ok'
-                    if InstanceTest and SystemTest:
-                        d['StatusCheck'] = '2/2 checks passed'
-                    else:
-                        d['StatusCheck'] = 'Initializing'  
-                # Appends self.instancesData with the dictionary
-                # as one entry.
-                instancesData.append(d.copy())
-            
-            # Onces instances is ready it returns it, and 
-            # ponetrially saves it as self.instancesData
-            if client is None:
-                self.instancesData = instancesData
-                if self.instancesData == old_instancesData:
-                    return 'NoChange'
-                elif len(self.instancesData)==len(old_instancesData):
-                    sameIDs = 0
-                    for i in range(len(self.instancesData)):
-                        if self.instancesData[i]['InstanceId'] \
-                             == old_instancesData[i]['InstanceId']:
-                            sameIDs += 1
-                    if sameIDs == len(self.instancesData):
-                        return 'AttributeChange'
-                    else:
-                        return 'InstanceChange'
+            futures = [self.executor.submit(self.poll_chunk, *c)
+                       for c in chunks]
+            results = [f.result() for f in as_completed(futures)]
+        for ids, new in results:
+            if new is None:
+                continue
+            with self.instances_lock:
+                if self.connect_id != connect_id:
+                    return InstanceDiff({}, {})
+                old = {}
+                for i in ids:
+                    if i in self.instancesData:
+                        old[i] = self.instancesData[i]
+                d = InstanceDiff(old, new)
+                for i in d.removed:
+                    self.instancesData.pop(i, None)
+                for i, record in new.items():
+                    self.instancesData[i] = record
+                self.transitions.update(self.instancesData)
+            diff.extend(d)
+            if callback is not None and not d.isEmpty():
+                callback(d)
+        return diff
     
-    def act_instances(self, indexes, act):
+    def poll_chunk(self, target, client, ids):
         '''
-        indexes --> list with indexes of instance which
-                        will act upon.
-        act --> 'start', 'stop', 'reboot', 'terminate'
+        Part of poll_transitions. Requests the instances ids
+        of target with the given client. Returns [ids, new],
+        where new is the dict of InstanceRecords that AWS
+        returned, or None if the request failed.
         '''
+        from botocore.exceptions import ClientError
         try:
-            ids = []
-            for i in indexes:
-                ids.append(self.instancesData[i]['InstanceId'])
+            f = self.instance_filter
+            plan = FetchPlan(self.user_data.InstanceView, f)
+            # A running instance was pending a moment ago, so
+            # its status checks are still initializing.
+            statusChecks = {} if plan.statusChecks else None
+            new = {}
+            for d in self.iter_instances(client, statusChecks,
+                                         f.instanceFilters(),
+                                         plan.tags, target, ids):
+                new[d.InstanceId] = d
+            return [ids, new]
+        except ClientError as e:
+            if e.response['Error']['Code'] in THROTTLE_ERRORS:
+                self.throttled_at = time.time()
+            return [ids, None]
+        except:
+            # Retried later, with a longer delay
+            return [ids, None]
+    
+    def isThrottled(self, window = 60):
+        '''
+        Returns True if AWS throttled a request within the
+        last window sec, even if it succeeded when retried.
+        '''
+        last = max(self.throttled_at, client_pool.throttled_at)
+        return time.time() - last < window
+    
+    def throttle_count(self):
+        '''
+        Returns the number of requests that AWS throttled
+        since the application started.
+        '''
+        return client_pool.throttleCount()
+    
+    def act_instances(self, ids, act):
+        '''
+        ids --> list with the InstanceIds of the instances
+                        which will act upon.
+        act --> 'start', 'stop', 'reboot', 'terminate'
+        
+        The instances are grouped by target, and split in
+        chunks of at most ACT_CHUNK. If there are many chunks
+        (e.g. several regions, or hundreds of instances), they
+        run concurrently on self.executor.
+        
+        Returns dict InstanceId --> [state, error], where state
+        is the state AWS reports after the request (e.g.
+        'stopping', or '' if it does not report one, as for
+        reboot) and error is '' or the error code of that
+        instance. Pass it to apply_act_results to update
+        self.instancesData. If an InstanceId is not in
+        self.instancesData, it returns 'IdDoesNotExist'.
+        '''
+        # Groups the instances by target, as each profile
+        # and region needs its own client.
+        targetIds = {}
+        for i in ids:
+            if i not in self.instancesData:
+                return 'IdDoesNotExist'
+            target = self.instancesData[i].target()
+            targetIds.setdefault(target, []).append(i)
+        results = {}
+        chunks = []
+        for target, ids in targetIds.items():
             try:
-                if act == 'start':
-                    self.client.start_instances(InstanceIds = ids)
-                elif act == 'stop':
-                    self.client.stop_instances(InstanceIds = ids)
-                elif act == 'reboot':
-                    self.client.reboot_instances(InstanceIds = ids)
-                elif act == 'terminate':
-                    self.client.terminate_instances(InstanceIds = ids)
-                return 'NoError'
+                client = self.get_client(*target)
             except:
-                return 'ConnectionError'
+                for i in ids:
+                    results[i] = ['', 'ConnectionError']
+                continue
+            for k in range(0, len(ids), ACT_CHUNK):
+                chunks.append([client, ids[k:k+ACT_CHUNK], act])
+        if len(chunks) == 1:
+            results.update(self.act_chunk(*chunks[0]))
+        else:
+            futures = [self.executor.submit(self.act_chunk, *c)
+                       for c in chunks]
+            for f in as_completed(futures):
+                results.update(f.result())
+        return results
+    
+    def act_chunk(self, client, ids, act):
+        '''
+        Part of act_instances. Requests act on ids with a
+        single call. AWS rejects the whole call if one of the
+        instances can not be acted upon, so if it fails, ids
+        is split in two halves which are requested again, down
+        to the instances that fail. Errors that concern the
+        whole request (see ACT_REQUEST_ERRORS) are not split.
+        Returns dict InstanceId --> [state, error].
+        '''
+        from botocore.exceptions import ClientError
+        method, key = ACTIONS[act]
+        try:
+            response = getattr(client, method)(InstanceIds = ids)
+        except ClientError as e:
+            error = e.response['Error']['Code']
+            if len(ids) == 1 or error in ACT_REQUEST_ERRORS:
+                if error in THROTTLE_ERRORS:
+                    error = 'Throttled'
+                return {i: ['', error] for i in ids}
+            half = len(ids) // 2
+            results = self.act_chunk(client, ids[:half], act)
+            results.update(self.act_chunk(client, ids[half:], act))
+            return results
         except:
-            return 'IndexDoesNotExist'
+            return {i: ['', 'ConnectionError'] for i in ids}
+        results = {i: ['', ''] for i in ids}
+        if key is not None:
+            for r in response.get(key, []):
+                results[r['InstanceId']] = [r['CurrentState']['Name'], '']
+        return results
+    
+    def apply_act_results(self, results):
+        '''
+        results --> dict returned by act_instances
+        Sets the state that AWS reported for each instance in
+        self.instancesData, so it is shown before the next
+        update, and returns the InstanceDiff.
+        '''
+        old = {}
+        new = {}
+        with self.instances_lock:
+            for i, [state, error] in results.items():
+                d = self.instancesData.get(i)
+                if d is None or error != '' or \
+                        state in ['', d.InstanceState]:
+                    continue
+                old[i] = d
+                new[i] = d.replace(InstanceState = sys.intern(state),
+                                   StatusCheck = '')
+                self.instancesData[i] = new[i]
+        return InstanceDiff(old, new)
     
     def launch_instance(self, name, imageId, instanceType,
                            keyPair, secGroup):
         '''
         Launches AWS instance.
         '''
+        from botocore.exceptions import ClientError
         if imageId == '':
             return 'NoAmiIdError'
         elif instanceType == '':
@@ -479,7 +1057,7 @@ class Backend():
             except ClientError as e:
                 return e.response['Error']['Code']
     
-    def get_more_info(self, idx):
+    def get_more_info(self, InstanceId):
         '''
         Return Text with information on how to Log In to the 
         chosen instance through:
@@ -488,11 +1066,11 @@ class Backend():
         3) the Jupyter Notebook
         '''
         user = 'ubuntu@'
-        KeyName  = self.instancesData[idx]['KeyName']
+        KeyName  = self.instancesData[InstanceId]['KeyName']
         rel_path = 'resources/key_pairs/' + KeyName + '.pem'
         abs_path = os.path.abspath(rel_path)
-        UserPublicIp = user  + self.instancesData[idx]['PublicIp']
-        UserDNS = user + self.instancesData[idx]['PublicDns']
+        UserPublicIp = user  + self.instancesData[InstanceId]['PublicIp']
+        UserDNS = user + self.instancesData[InstanceId]['PublicDns']
         
         t1 = '1) To ensure that Key Pair is accessible write on local terminal:\n' \
               + 'chmod 400 ' + abs_path
@@ -502,7 +1080,7 @@ class Backend():
               + abs_path + ' ' + UserPublicIp
                 
         t3 = '3) To log in through an FTP client provide:\n' \
-                + 'server: ' + self.instancesData[idx]['PublicIp'] \
+                + 'server: ' + self.instancesData[InstanceId]['PublicIp'] \
                 + '\nusername: ' + 'ubuntu' \
                 + '\nSSH Pr. Key: ' + abs_path
         
@@ -516,81 +1094,619 @@ class Backend():
                 
         return t1 + '\n\n' + t2 + '\n\n' + t3 + '\n\n' + t4
 
-class User_Data():
+class InstanceRecord():
     '''
-    Class that saves and retrives used data from the disk
+    Compact version of a single instance, as it appears in the
+    response of boto3 --> describe_instances, which is used to
+    build the GUI instance table.
+    
+    It only has the attributes listed in __slots__ (i.e. no
+    dict per instance), and the values that repeat across
+    instances (state, type, zone, VPC, ...) are interned, so
+    all instances share a single copy of them. Attributes can
+    also be read as record['InstanceId'].
     '''
+    __slots__ = ('InstanceName', 'InstanceId', 'InstanceState',
+                 'InstanceType', 'StatusCheck', 'AvailabilityZone',
+                 'SecurityGroupId', 'SecurityGroupName', 'ImageId',
+                 'KeyName', 'PublicDns', 'PublicIp', 'PrivateDns',
+                 'PrivateIp', 'VpcId', 'SubnetId', 'Region',
+                 'Profile')
+    
     def __init__(self):
         '''
-        Attemps to load pickle object with user data. If it
-        does not exist, it initialises it empty.
+        Returns a record with all attributes set to ''. The
+        records of a response are built by fromReservations.
+        '''
+        for k in self.__slots__:
+            setattr(self, k, '')
+    
+    @classmethod
+    def fromReservations(cls, reservations, statusChecks = None,
+                         tags = True, target = ('', '')):
+        '''
+        reservations --> list of reservations, as it appears in
+              the response of boto3 --> describe_instances.
+        statusChecks --> dict as returned by get_status_checks.
+                         If None, StatusCheck is left empty.
+        tags --> if False, InstanceName is left empty
+        target --> [profile, region] of the instances
+        
+        Returns list with one record for every instance of
+        every reservation. Every attribute is read in a single
+        pass, without calling __init__ per instance, and only
+        the values that repeat across instances are interned.
+        '''
+        new = object.__new__
+        intern = sys.intern
+        profile = intern(target[0])
+        region = intern(target[1])
+        records = []
+        for y in reservations:
+            for i in y['Instances']:
+                d = new(cls)
+                get = i.get
+                # If Tags exist, looks for the Tag with Key =
+                # 'Name'. If there is none uses the first Tag.
+                name = ''
+                if tags:
+                    t = get('Tags')
+                    if t:
+                        name = t[0]['Value']
+                        for tag in t:
+                            if tag['Key'] == 'Name':
+                                name = tag['Value']
+                                break
+                d.InstanceName = name
+                d.InstanceId = i['InstanceId']
+                d.InstanceState = intern(i['State']['Name'])
+                d.InstanceType = intern(i['InstanceType'])
+                d.AvailabilityZone = intern(
+                            i['Placement']['AvailabilityZone'])
+                groups = get('SecurityGroups')
+                if groups:
+                    d.SecurityGroupId = intern(groups[0]['GroupId'])
+                    d.SecurityGroupName = intern(groups[0]['GroupName'])
+                else:
+                    d.SecurityGroupId = ''
+                    d.SecurityGroupName = ''
+                d.ImageId = intern(i['ImageId'])
+                d.KeyName = intern(get('KeyName', ''))
+                # Some keys do not always exist
+                d.PublicDns = get('PublicDnsName', '')
+                d.PublicIp = get('PublicIpAddress', '')
+                d.PrivateDns = get('PrivateDnsName', '')
+                d.PrivateIp = get('PrivateIpAddress', '')
+                d.VpcId = intern(get('VpcId', ''))
+                d.SubnetId = intern(get('SubnetId', ''))
+                d.Profile = profile
+                d.Region = region
+                # Joins the status report, which was fetched for
+                # all instances at once, using the InstanceId.
+                if statusChecks is not None and \
+                        d.InstanceState == 'running':
+                    d.StatusCheck = statusChecks.get(d.InstanceId,
+                                                     'Initializing')
+                else:
+                    d.StatusCheck = ''
+                records.append(d)
+        return records
+    
+    def target(self):
+        '''Returns (Profile, Region) of the instance'''
+        return (self.Profile, self.Region)
+    
+    def replace(self, **values):
+        '''
+        Returns a copy of the record, with the given
+        attributes replaced, e.g. replace(InstanceState = 'stopping').
+        '''
+        d = InstanceRecord.__new__(InstanceRecord)
+        for k in self.__slots__:
+            setattr(d, k, values.get(k, getattr(self, k)))
+        return d
+    
+    def __getitem__(self, label):
+        return getattr(self, label)
+    
+    def __eq__(self, other):
+        for k in self.__slots__:
+            if getattr(self, k) != getattr(other, k):
+                return False
+        return True
+
+class FetchPlan():
+    '''
+    Decides which requests to AWS, and which parts of their
+    response, are needed by get_instances, using the columns
+    that are visible on the GUI table:
+    statusChecks --> True if describe_instance_status is called,
+                which is only needed for the StatusCheck column
+                and if the filter allows running instances.
+    tags --> True if the InstanceName is resolved from the Tags,
+                which is only needed for the InstanceName column.
+    '''
+    def __init__(self, view, instance_filter = None):
+        '''
+        view --> dict as User_Data.InstanceView
+        instance_filter --> InstanceFilter used with the request
+        '''
+        self.statusChecks = view.get('StatusCheck', True)
+        if instance_filter is not None:
+            self.statusChecks = self.statusChecks and \
+                instance_filter.allowsState('running')
+        self.tags = view.get('InstanceName', True)
+
+class InstanceFilter():
+    '''
+    Specification of the instances shown on the GUI table,
+    which is pushed to AWS as the Filters of describe_instances
+    and describe_instance_status. Every entry is a str, and an
+    empty str means no filter. Several values can be given
+    separated by commas, and AWS wildcards (e.g. p3.*) work.
+    state --> e.g. 'running' or 'running,stopped'
+    instanceType --> e.g. 'p3.*'
+    tag --> 'key' (any value) or 'key=value'
+    vpcId --> e.g. 'vpc-1a2b3c4d'
+    zone --> e.g. 'us-east-1a'
+    '''
+    def __init__(self, state = '', instanceType = '', tag = '',
+                 vpcId = '', zone = ''):
+        self.state = state
+        self.instanceType = instanceType
+        self.tag = tag
+        self.vpcId = vpcId
+        self.zone = zone
+    
+    def values(self, text):
+        '''Splits text into the list of values it contains'''
+        out = []
+        for v in text.split(','):
+            v = v.strip()
+            if v != '':
+                out.append(v)
+        return out
+    
+    def allowsState(self, state):
+        '''
+        Returns False if the filter excludes instances with the
+        given state (in which case they need no status checks).
+        '''
+        states = self.values(self.state)
+        return states == [] or state in states
+    
+    def statusFilters(self):
+        '''
+        Returns the subset of the filters that is supported by
+        describe_instance_status.
+        '''
+        Filters = []
+        if self.values(self.state):
+            Filters.append({'Name': 'instance-state-name',
+                            'Values': self.values(self.state)})
+        if self.values(self.zone):
+            Filters.append({'Name': 'availability-zone',
+                            'Values': self.values(self.zone)})
+        return Filters
+    
+    def instanceFilters(self):
+        '''
+        Returns the filters in the format of describe_instances.
+        '''
+        Filters = self.statusFilters()
+        if self.values(self.instanceType):
+            Filters.append({'Name': 'instance-type',
+                            'Values': self.values(self.instanceType)})
+        if self.values(self.vpcId):
+            Filters.append({'Name': 'vpc-id',
+                            'Values': self.values(self.vpcId)})
+        key, _, value = self.tag.partition('=')
+        key = key.strip()
+        if key != '' and self.values(value):
+            Filters.append({'Name': 'tag:' + key,
+                            'Values': self.values(value)})
+        elif key != '':
+            Filters.append({'Name': 'tag-key',
+                            'Values': [key]})
+        return Filters
+
+class TransitionTracker():
+    '''
+    Keeps the instances that are in one of the
+    TRANSITION_STATES, and when each of them has to be polled
+    next. The first poll is after delay sec, and the delay of
+    each instance grows by factor on every poll in which it is
+    still changing (up to max_delay), so long transitions do
+    not keep asking AWS every second.
+    '''
+    def __init__(self, delay = 1, factor = 1.5, max_delay = 10):
+        self.delay = delay
+        self.factor = factor
+        self.max_delay = max_delay
+        # InstanceId --> [state, time of next poll, delay]
+        self.tracked = {}
+    
+    def update(self, instancesData):
+        '''
+        instancesData --> dict of InstanceRecords keyed by
+        InstanceId. Starts tracking the instances that entered
+        a transition state, backs off the ones that are still
+        in the same state, and drops the rest.
+        '''
+        now = time.time()
+        tracked = {}
+        for i, d in instancesData.items():
+            state = d.InstanceState
+            if state not in TRANSITION_STATES:
+                continue
+            t = self.tracked.get(i)
+            if t is None or t[0] != state:
+                tracked[i] = [state, now + self.delay, self.delay]
+            else:
+                tracked[i] = t
+        self.tracked = tracked
+    
+    def due(self):
+        '''
+        Returns list with the InstanceIds that have to be
+        polled now, and schedules their next poll.
+        '''
+        now = time.time()
+        out = []
+        for i, t in self.tracked.items():
+            if t[1] <= now:
+                out.append(i)
+                t[2] = min(t[2] * self.factor, self.max_delay)
+                t[1] = now + t[2]
+        return out
+    
+    def isEmpty(self):
+        '''Returns True if no instance is changing'''
+        return self.tracked == {}
+
+class InstanceDiff():
+    '''
+    Difference between two versions of Backend.instancesData,
+    keyed by InstanceId:
+    added --> list of InstanceIds that only exist in new
+    removed --> list of InstanceIds that only exist in old
+    changed --> dict that maps each InstanceId that exists in
+                both to the set of labels whose value changed
+    instancesData --> dict with the new entries of the added
+                and changed instances, which are all that is
+                needed to patch a table showing old.
+    '''
+    def __init__(self, old, new):
         '''
+        old, new --> dicts of InstanceRecords keyed by InstanceId
+        '''
+        self.added = []
+        self.removed = []
+        self.changed = {}
+        self.instancesData = {}
+        for i in old:
+            if i not in new:
+                self.removed.append(i)
+        for i, d in new.items():
+            if i not in old:
+                self.added.append(i)
+                self.instancesData[i] = d
+            else:
+                o = old[i]
+                labels = set()
+                for k in InstanceRecord.__slots__:
+                    if getattr(d, k) != getattr(o, k):
+                        labels.add(k)
+                if labels:
+                    self.changed[i] = labels
+                    self.instancesData[i] = d
+    
+    def extend(self, other):
+        '''
+        Adds the changes of other, which must refer to
+        different instances.
+        '''
+        self.added.extend(other.added)
+        self.removed.extend(other.removed)
+        self.changed.update(other.changed)
+        self.instancesData.update(other.instancesData)
+    
+    def isEmpty(self):
+        '''Returns True if nothing changed'''
+        return not (self.added or self.removed or self.changed)
+
+class MetadataCache():
+    '''
+    Lists of METADATA (and AMI names) of each target
+    ([profile, region]), saved on the Store with the time
+    they were requested, so that connect can show them before
+    AWS answers. Each kind of list has its own time to live.
+    
+    AMI names are stored as a dict {ImageId: name} of the
+    target ['', region], as AMI ids depend on the region but
+    not on the profile. Ids that do not exist map to ''.
+    '''
+    def __init__(self, store):
+        '''
+        store --> Store where the lists are saved
+        '''
+        self.store = store
+        # Seconds after which each kind of list is requested again
+        self.ttl = {'key_pairs': 3600,
+                    'security_groups': 3600,
+                    'Vpcs': 24*3600,
+                    'ImageNames': 7*24*3600}
+        # (profile, region) --> {name: [values, time]}
+        self.data = {}
+        self.lock = threading.Lock()
         try:
-            with open('resources/user_data.pkl', 'rb') as input:
-                imported_data = pickle.load(input)
-            # Copies data from the imported object
-            self.profile = imported_data.profile
-            self.access_key_id = imported_data.access_key_id
-            self.secret_access_key = imported_data.secret_access_key
-            self.ec2_regions = imported_data.ec2_regions
-            self.default_region = imported_data.default_region
-            self.key_pairs_files = imported_data.key_pairs_files
-            self.InstanceView = imported_data.InstanceView
-            self.ImageIds = imported_data.ImageIds
-            self.ImageNames = imported_data.ImageNames
-            self.InstanceTypes = imported_data.InstanceTypes
-            del imported_data
+            self.data = self.store.read_metadata()
         except:
-            # Initialises all attributes empty
-            self.profile = []
-            self.access_key_id = []
-            self.secret_access_key = []
-            # Initialises list of regions that support EC2, below
-            # list a given on 20-Jun-2018
-            self.ec2_regions = ['ap-south-1', 'eu-west-3', 'eu-west-2',
-                                'eu-west-1','ap-northeast-2',
-                                'ap-northeast-1', 'sa-east-1',
-                                'ca-central-1', 'ap-southeast-1',
-                                'ap-southeast-2', 'eu-central-1', 
-                                'us-east-1', 'us-east-2', 
-                                'us-west-1', 'us-west-2']
-            self.default_region = 'ap-south-1'
-            self.key_pairs_files = []
-            
-            # List of attributes that appear on the running
-            # instance table.
-            self.InstanceView = {
-                                'InstanceName': True,
-                                'InstanceId' : True,
-                                'InstanceState' : True,
-                                'InstanceType' : True,
-                                'StatusCheck' : True,
-                                'AvailabilityZone' : True,
-                                'SecurityGroupId' : True,
-                                'SecurityGroupName' : True,
-                                'ImageId' : True,
-                                'KeyName' : True,
-                                'PublicDns' : True,
-                                'PublicIp' : True,
-                                'PrivateDns' : True,
-                                'PrivateIp' : True,
-                                'VpcId' : True,
-                                'SubnetId' : True}
-            # List of AMIs Ids. Names are taken by AWS
-            # after a successful log in.
-            self.ImageIds = ['ami-1a8c8a63', 'ami-31cbc748',
-                             'ami-958d8bec', 'ami-6babae12',
-                             'ami-66abae1f', 'ami-2fb0c956']
-            self.ImageNames = ['', '', '', '', '', '']
-            # List of Instance Types
-            self.InstanceTypes = ['p2.xlarge', 'p2.8xlarge',
-                                 'p2.16xlarge', 'p3.2xlarge',
-                                 'p3.8xlarge', 'p3.16xlarge']
-            self.save()
-    
-    def save(self):
-        with open('resources/user_data.pkl', 'wb') as output:
-            pickle.dump(self, output, pickle.HIGHEST_PROTOCOL)
+            pass
+    
+    def get(self, target, name):
+        '''
+        Returns [values, fresh], where fresh is False if the
+        values are older than their ttl, or [None, False] if
+        nothing is cached.
+        '''
+        with self.lock:
+            entry = self.data.get(tuple(target), {}).get(name)
+        if entry is None:
+            return [None, False]
+        fresh = time.time() - entry[1] < self.ttl.get(name, 0)
+        return [entry[0], fresh]
+    
+    def put(self, target, name, values):
+        '''
+        Stores values with the current time. Returns True if
+        they are different from the cached ones.
+        '''
+        with self.lock:
+            lists = self.data.setdefault(tuple(target), {})
+            changed = name not in lists or lists[name][0] != values
+            lists[name] = [values, time.time()]
+        # Only the row of this list is written
+        try:
+            self.store.put_metadata(target, name, values,
+                                    lists[name][1])
+        except:
+            pass
+        return changed
+
+class User_Data():
+    '''
+    Class that saves and retrives used data from the disk
+    '''
+    # Attributes --> table of the Store where they are saved
+    TABLE_OF = {'profile': 'profiles',
+                'access_key_id': 'profiles',
+                'secret_access_key': 'profiles',
+                'ec2_regions': 'settings',
+                'ec2_regions_time': 'settings',
+                'regions_ttl': 'settings',
+                'default_region': 'settings',
+                'key_pairs_files': 'key_pairs_files',
+                'InstanceView': 'instance_view',
+                'ImageIds': 'images',
+                'ImageNames': 'images',
+                'InstanceTypes': 'instance_types'}
+    
+    def __init__(self, path = 'resources/user_data.db',
+                 pickle_path = 'resources/user_data.pkl'):
+        '''
+        Loads the user data from the Store (an SQLite file at
+        path). If it is empty, it migrates the pickle object
+        used by older versions, and if that does not exist
+        either, it initialises it empty.
+        '''
+        self.store = Store(path)
+        # Tables waiting to be written by flush --> their rows
+        self.dirty = {}
+        self.save_delay = 0.5
+        self.save_timer = None
+        self.save_lock = threading.Lock()
+        # Held for the whole write of flush
+        self.flush_lock = threading.Lock()
+        # Pending changes are written if the application exits
+        # without closing the main window.
+        atexit.register(self.flush)
+        self.set_defaults()
+        if not self.store.isEmpty():
+            self.load()
+        else:
+            try:
+                self.migrate(pickle_path)
+            except:
+                self.save()
+    
+    def set_defaults(self):
+        '''
+        Initialises all attributes empty
+        '''
+        self.profile = []
+        self.access_key_id = []
+        self.secret_access_key = []
+        # Initialises list of regions that support EC2, below
+        # list a given on 20-Jun-2018
+        self.ec2_regions = ['ap-south-1', 'eu-west-3', 'eu-west-2',
+                            'eu-west-1','ap-northeast-2',
+                            'ap-northeast-1', 'sa-east-1',
+                            'ca-central-1', 'ap-southeast-1',
+                            'ap-southeast-2', 'eu-central-1', 
+                            'us-east-1', 'us-east-2', 
+                            'us-west-1', 'us-west-2']
+        # Time (time.time()) at which ec2_regions was
+        # requested from AWS, and time (in sec) after which
+        # it is requested again.
+        self.ec2_regions_time = 0
+        self.regions_ttl = 7*24*3600
+        self.default_region = 'ap-south-1'
+        self.key_pairs_files = []
+        
+        # List of attributes that appear on the running
+        # instance table.
+        self.InstanceView = self.default_InstanceView()
+        # List of AMIs Ids. Names are taken by AWS
+        # after a successful log in.
+        self.ImageIds = ['ami-1a8c8a63', 'ami-31cbc748',
+                         'ami-958d8bec', 'ami-6babae12',
+                         'ami-66abae1f', 'ami-2fb0c956']
+        self.ImageNames = ['', '', '', '', '', '']
+        # List of Instance Types
+        self.InstanceTypes = ['p2.xlarge', 'p2.8xlarge',
+                             'p2.16xlarge', 'p3.2xlarge',
+                             'p3.8xlarge', 'p3.16xlarge']
+    
+    def load(self):
+        '''
+        Reads every table of the Store.
+        '''
+        for key, value in self.store.read('settings').items():
+            setattr(self, key, value)
+        rows = self.store.read('profiles')
+        self.profile = [r[1] for r in rows]
+        self.access_key_id = [r[2] for r in rows]
+        self.secret_access_key = [r[3] for r in rows]
+        # Columns added after the data were saved are shown
+        for r in self.store.read('instance_view'):
+            if r[1] in self.InstanceView:
+                self.InstanceView[r[1]] = bool(r[2])
+        rows = self.store.read('images')
+        self.ImageIds = [r[1] for r in rows]
+        self.ImageNames = [r[2] for r in rows]
+        rows = self.store.read('instance_types')
+        self.InstanceTypes = [r[1] for r in rows]
+        rows = self.store.read('key_pairs_files')
+        self.key_pairs_files = [json.loads(r[2]) for r in rows]
+    
+    def migrate(self, pickle_path):
+        '''
+        Copies the data of the pickle object saved by older
+        versions, which is then renamed so that it is only
+        migrated once.
+        '''
+        with open(pickle_path, 'rb') as input:
+            imported_data = pickle.load(input)
+        # Copies data from the imported object
+        self.profile = imported_data.profile
+        self.access_key_id = imported_data.access_key_id
+        self.secret_access_key = imported_data.secret_access_key
+        self.ec2_regions = imported_data.ec2_regions
+        # Data saved before the regions were timestamped
+        # are refreshed at the next chance.
+        self.ec2_regions_time = getattr(imported_data,
+                                    'ec2_regions_time', 0)
+        self.regions_ttl = getattr(imported_data, 'regions_ttl',
+                                   7*24*3600)
+        self.default_region = imported_data.default_region
+        self.key_pairs_files = imported_data.key_pairs_files
+        # Columns added after the data were saved are shown
+        for k in self.InstanceView:
+            if k in imported_data.InstanceView:
+                self.InstanceView[k] = imported_data.InstanceView[k]
+        self.ImageIds = imported_data.ImageIds
+        self.ImageNames = imported_data.ImageNames
+        self.InstanceTypes = imported_data.InstanceTypes
+        del imported_data
+        self.save()
+        self.flush()
+        os.replace(pickle_path, pickle_path + '.migrated')
+    
+    def default_InstanceView(self):
+        '''
+        Returns dict with all the attributes that can appear on
+        the running instance table (in the order of its columns)
+        all set to True.
+        '''
+        return {'InstanceName': True,
+                'InstanceId' : True,
+                'InstanceState' : True,
+                'InstanceType' : True,
+                'StatusCheck' : True,
+                'AvailabilityZone' : True,
+                'Region' : True,
+                'Profile' : True,
+                'SecurityGroupId' : True,
+                'SecurityGroupName' : True,
+                'ImageId' : True,
+                'KeyName' : True,
+                'PublicDns' : True,
+                'PublicIp' : True,
+                'PrivateDns' : True,
+                'PrivateIp' : True,
+                'VpcId' : True,
+                'SubnetId' : True}
+    
+    def save(self, *attributes):
+        '''
+        attributes --> names of the attributes that changed,
+                       e.g. save('ImageIds'). Only their tables
+                       are written. If none is given, all the
+                       tables are written.
+        The tables are only marked as dirty, and they are
+        written by flush on a background thread save_delay sec
+        after the first save, so that a burst of changes
+        becomes a single write.
+        '''
+        if attributes == ():
+            attributes = self.TABLE_OF.keys()
+        with self.save_lock:
+            # The rows are taken now, so that the flush writes
+            # the data as it was at the latest save.
+            for a in attributes:
+                table = self.TABLE_OF[a]
+                self.dirty[table] = self.rows(table)
+            if self.save_timer is None:
+                self.save_timer = threading.Timer(self.save_delay,
+                                                  self.flush)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+    
+    def flush(self):
+        '''
+        Writes the tables marked by save, in a single
+        transaction. Called by the timer of save, and when the
+        application closes.
+        
+        A write that is already running (e.g. on the timer
+        thread) is waited for, so once flush returns all the
+        saved data is on the disk.
+        '''
+        with self.flush_lock:
+            with self.save_lock:
+                tables = self.dirty
+                self.dirty = {}
+                if self.save_timer is not None:
+                    self.save_timer.cancel()
+                    self.save_timer = None
+            if tables != {}:
+                self.store.write(tables)
+    
+    def rows(self, table):
+        '''
+        Returns the rows of table with the current data.
+        '''
+        if table == 'settings':
+            return {'ec2_regions': self.ec2_regions,
+                    'ec2_regions_time': self.ec2_regions_time,
+                    'regions_ttl': self.regions_ttl,
+                    'default_region': self.default_region}
+        elif table == 'profiles':
+            return list(zip(range(len(self.profile)), self.profile,
+                            self.access_key_id,
+                            self.secret_access_key))
+        elif table == 'instance_view':
+            return [(i, k, int(v)) for i, (k, v)
+                    in enumerate(self.InstanceView.items())]
+        elif table == 'images':
+            return list(zip(range(len(self.ImageIds)), self.ImageIds,
+                            self.ImageNames))
+        elif table == 'instance_types':
+            return list(enumerate(self.InstanceTypes))
+        elif table == 'key_pairs_files':
+            return [(i, k['KeyName'], json.dumps(k, default = str))
+                    for i, k in enumerate(self.key_pairs_files)]
             
     def add_profile(self, profile, access_key_id, secret_access_key):
         '''
@@ -612,21 +1728,20 @@ class User_Data():
         else:
             try:
                 # The instance is defined even with invalid credentials
-                ec2 = boto3.client('ec2',
-                    aws_access_key_id = access_key_id, 
-                    aws_secret_access_key = secret_access_key
-                                  )
+                ec2 = client_pool.client(profile, self.home_region(),
+                            [access_key_id, secret_access_key])
                 # This is where invalid credentials return error
                 responce = ec2.describe_regions()
+                self.set_regions(responce)
                 # If no error, then profile is added.
                 self.profile.append(profile)
                 self.access_key_id.append(access_key_id)
                 self.secret_access_key.append(secret_access_key)
-                self.save()
+                self.save('profile', 'ec2_regions')
                 return 'NoError'
             except:
+                client_pool.discard(profile)
                 return 'InvalidCredentials'
-            del ec2
                 
     def delete_profile(self, profile):
         '''Deletes profile using its name'''
@@ -635,7 +1750,8 @@ class User_Data():
             del self.profile[i]
             del self.access_key_id[i]
             del self.secret_access_key[i]
-            self.save()
+            client_pool.discard(profile)
+            self.save('profile')
         except:
             return 'Error'
     
@@ -651,34 +1767,60 @@ class User_Data():
         except:
             return None
     
-    def update_regions(self):
+    def home_region(self):
+        '''
+        Returns default_region if it is a single region, and
+        otherwise 'us-east-1' (or the first of ec2_regions).
+        '''
+        if self.default_region in self.ec2_regions:
+            return self.default_region
+        elif 'us-east-1' in self.ec2_regions:
+            return 'us-east-1'
+        return self.ec2_regions[0]
+    
+    def regions_stale(self):
+        '''
+        Returns True if ec2_regions is older than regions_ttl.
+        '''
+        return time.time() - self.ec2_regions_time > self.regions_ttl
+    
+    def set_regions(self, responce):
         '''
-        If a profile that can log in to AWS exists, then it
-        uses it to request list of regions that support EC2
-        instances.
+        responce --> response of boto3 --> describe_regions
+        Updates ec2_regions and the time it was requested.
         '''
+        updated_list = []
+        for i in responce['Regions']:
+            updated_list.append(i['RegionName'])
+        if updated_list != []:
+            self.ec2_regions = updated_list
+            self.ec2_regions_time = time.time()
+    
+    def update_regions(self, force = False):
+        '''
+        If ec2_regions is stale (or force is True) and a
+        profile that can log in to AWS exists, then it uses
+        it to request list of regions that support EC2
+        instances. Returns True if the list was requested.
+        
+        Backend.connect also refreshes the list with the
+        describe_regions that validates the credentials.
+        '''
+        if not force and not self.regions_stale():
+            return False
         # Loops through profiles until it finds a valid one.
-        i = 0
-        stop = False
-        while stop == False and i<len(self.profile):
-            # The instance is defined even with invalid credentials
-            ec2 = boto3.client('ec2',
-                    aws_access_key_id = self.access_key_id[i], 
-                    aws_secret_access_key = self.secret_access_key[i]
-                              )
+        for profile in list(self.profile):
             try:
+                # The instance is defined even with invalid credentials
+                ec2 = client_pool.client(profile, self.home_region(),
+                            self.pass_credentials(profile))
                 # This is where invalid credentials return error
-                responce = ec2.describe_regions()
-                updated_list = []
-                for i in responce['Regions']:
-                    updated_list.append(i['RegionName'])
-                # If regions successfully retrived signals to stop
-                stop = True
-                # Updates list of regions of the User Data instance
-                self.ec2_regions = updated_list
+                self.set_regions(ec2.describe_regions())
+                self.save('ec2_regions')
+                return True
             except:
-                i += 1
-            del ec2
+                pass
+        return False
             
     def add_AMI(self, imageId, client):
         '''
@@ -691,7 +1833,7 @@ class User_Data():
             responce = client.describe_images(ImageIds=[imageId])
             self.ImageIds.append(imageId)
             self.ImageNames.append(responce['Images'][0]['Name'])
-            self.save()
+            self.save('ImageIds')
             return 'NoError'
         except:
             return 'Error'
@@ -704,63 +1846,43 @@ class User_Data():
             i = self.ImageIds.index(imageId)
             del self.ImageIds[i]
             del self.ImageNames[i]
-            self.save()
+            self.save('ImageIds')
             return 'NoError'
         except:
             return 'Error'
     
-    def get_AmiNames(self, client = None):
-        '''
-        For each amiId that doesn't have a corresponding name
-        attempts to get it from AWS using client.
-        
-        If client is not given, then loops through saved
-        profiles.
-        '''
-        
-        if '' in self.ImageNames:
-            # If no client, loops through profiles to find a valid one.
-            if client is None:    
-                i = 0
-                stop = False
-                while stop == False and i<len(self.profile):
-                    # The instance is defined even with invalid credentials
-                    client = boto3.client('ec2',
-                        aws_access_key_id = self.access_key_id[i], 
-                        aws_secret_access_key = self.secret_access_key[i]
-                                             )
-                    # If this fails because of DryRun, the valid client
-                    try:
-                        client.describe_regions(DryRun=True)
-                    except ClientError as e:
-                        error = e.response['Error']['Code']
-                        if error == 'DryRunOperation':
-                            stop = True
-                        else:
-                            client = None
-                            i += 1
-            # If client is given, checks if a valid one.
-            else:
-                try:
-                    client.describe_regions(DryRun=True)
-                except ClientError as e:
-                    error = e.response['Error']['Code']
-                    if error != 'DryRunOperation':
-                        client = None
-            # If above produces a valid client, retrieve names
-            if client is not None:
-                for i in range(len(self.ImageNames)):
-                    if self.ImageNames[i] == '':
-                        try:
-                            r =  client.describe_images(
-                                ImageIds=[self.ImageIds[i]])
-                            self.ImageNames[i] = r['Images'][0]['Name']
-                        except ClientError as e:
-                            # Depending on the region some AMIs may
-                            # not exist.
-                            pass
-                self.save()
-
+    def describe_AmiNames(self, client, ImageIds):
+        '''
+        Returns dict {ImageId: name} of the given ImageIds,
+        requested with a single describe_images. Ids that do
+        not exist on the region of client are removed from the
+        request, which is then retried, and they map to ''.
+        '''
+        from botocore.exceptions import ClientError
+        names = {}
+        for i in ImageIds:
+            names[i] = ''
+        ImageIds = list(names)
+        while ImageIds != []:
+            try:
+                r = client.describe_images(ImageIds = ImageIds)
+                for image in r['Images']:
+                    names[image['ImageId']] = image.get('Name', '')
+                break
+            except ClientError as e:
+                # e.g. InvalidAMIID.NotFound, with the missing
+                # ids in the message.
+                error = e.response['Error']
+                if not error['Code'].startswith('InvalidAMIID'):
+                    raise
+                bad = re.findall(r'ami-[0-9a-zA-Z]+',
+                                 error.get('Message', ''))
+                remaining = [i for i in ImageIds if i not in bad]
+                if len(remaining) == len(ImageIds):
+                    raise
+                ImageIds = remaining
+        return names
+    
     def add_InstanceType(self, InstanceType):
         '''
         InstanceType --> str with the type, only added if no
@@ -772,7 +1894,7 @@ class User_Data():
             return 'DuplicateError'
         else:
             self.InstanceTypes.append(InstanceType )
-            self.save()
+            self.save('InstanceTypes')
             return 'NoError'
         
     def delete_InstanceType(self, InstanceType):
@@ -782,7 +1904,7 @@ class User_Data():
         try:
             i = self.InstanceTypes.index(InstanceType)
             del self.InstanceTypes[i]
-            self.save()
+            self.save('InstanceTypes')
             return 'NoError'
         except:
             return 'Error'
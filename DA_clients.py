@@ -0,0 +1,426 @@
+'''
+Collection of classes used to create and share the boto3
+sessions and clients that connect with the AWS server.
+'''
+import time
+import random
+import threading
+from collections import OrderedDict
+
+# Priorities of the requests. USER requests (the actions of
+# the user) go before BACKGROUND ones (e.g. the refresh of
+# the instances), which also give up retrying sooner.
+USER = 0
+BACKGROUND = 1
+
+# Error codes with which AWS rejects requests that exceed its
+# rate limits, and other errors that are worth retrying.
+THROTTLE_ERRORS = ['RequestLimitExceeded', 'Throttling',
+                   'ThrottlingException']
+RETRY_ERRORS = ['InternalError', 'ServiceUnavailable', 'Unavailable']
+
+# Number of retries of a request, for each priority, and the
+# base and maximum of their random delay (in sec).
+MAX_RETRIES = {USER: 4, BACKGROUND: 1}
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 8
+
+# Sec during which the result of one of FRESH_CALLS is reused
+# by identical calls (see SingleFlight). These are small lists,
+# which are requested again right after each other (e.g. by
+# connect and the dialogs). Other describe calls, and every
+# paginated one, are only shared while they are in flight, so
+# that no page of instances is kept once it was consumed.
+FRESH_WINDOW = 1
+FRESH_CALLS = ['describe_regions', 'describe_key_pairs',
+               'describe_security_groups', 'describe_vpcs']
+
+# Attributes of a boto3 client that are not API calls
+NOT_CALLS = ['can_paginate', 'get_paginator', 'get_waiter',
+             'generate_presigned_url', 'close']
+
+class TokenBucket():
+    '''
+    Rate limiter shared by all the clients of one profile and
+    region, i.e. by all the requests that count against the
+    same limits of AWS. Each request takes a token, and the
+    tokens are refilled at rate per sec, up to burst.
+    
+    BACKGROUND requests leave reserve tokens in the bucket,
+    and wait while USER requests are waiting, so the actions
+    of the user go first.
+    '''
+    def __init__(self, rate = 10, burst = 20, reserve = 5):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = reserve
+        self.tokens = burst
+        self.time = time.monotonic()
+        # Number of USER requests waiting for a token
+        self.waiting = 0
+        self.cond = threading.Condition()
+    
+    def refill(self):
+        '''Must be called with self.cond held'''
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.time)*self.rate)
+        self.time = now
+    
+    def acquire(self, priority = USER):
+        '''
+        Blocks until a token is available for a request with
+        the given priority, and takes it.
+        '''
+        with self.cond:
+            if priority == USER:
+                self.waiting += 1
+                need = 1
+            else:
+                need = 1 + self.reserve
+            try:
+                while True:
+                    self.refill()
+                    if self.tokens >= need and (
+                            priority == USER or self.waiting == 0):
+                        self.tokens -= 1
+                        return
+                    self.cond.wait(max(need - self.tokens, 0.5)/self.rate)
+            finally:
+                if priority == USER:
+                    self.waiting -= 1
+                    self.cond.notify_all()
+    
+    def drain(self):
+        '''
+        Empties the bucket (e.g. when AWS throttles), so that
+        every request backs off.
+        '''
+        with self.cond:
+            self.refill()
+            self.tokens = 0
+
+class SingleFlight():
+    '''
+    Coalesces identical calls. While a call with a given key
+    runs, other callers with the same key wait for it and get
+    its result (or its exception), instead of doing the same
+    request again.
+    
+    A call can also ask for its result to be reused for window
+    sec after it arrived. Otherwise (window = 0, the default)
+    the result is dropped as soon as the call finishes, so
+    only the callers that were waiting for it keep it.
+    '''
+    def __init__(self):
+        # key -> [Event set when done, result, exception,
+        #         time it finished, window]
+        self.flights = {}
+        # Number of calls that got the result of another one
+        self.shared = 0
+        self.lock = threading.Lock()
+    
+    def do(self, key, function, *args, window = 0, **kwargs):
+        '''
+        Returns function(*args, **kwargs), or the result of
+        the running (or just finished) call with the same key.
+        '''
+        with self.lock:
+            self.prune()
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = [threading.Event(), None, None, 0, window]
+                self.flights[key] = flight
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        if leader:
+            try:
+                flight[1] = function(*args, **kwargs)
+            except BaseException as e:
+                flight[2] = e
+            flight[3] = time.monotonic()
+            with self.lock:
+                # Errors are only shared with the waiting calls
+                if flight[2] is not None or window == 0:
+                    if self.flights.get(key) is flight:
+                        del self.flights[key]
+                self.prune()
+            flight[0].set()
+        else:
+            flight[0].wait()
+        if flight[2] is not None:
+            raise flight[2]
+        return flight[1]
+    
+    def prune(self):
+        '''
+        Drops the results older than their window. Must be
+        called with self.lock held.
+        '''
+        now = time.monotonic()
+        for key in list(self.flights.keys()):
+            flight = self.flights[key]
+            if flight[0].is_set() and flight[3] + flight[4] < now:
+                del self.flights[key]
+    
+    def expire(self, prefix):
+        '''
+        Drops the finished results of the keys that start
+        with prefix (e.g. after a change on AWS).
+        '''
+        with self.lock:
+            for key in list(self.flights.keys()):
+                if key[0] == prefix and self.flights[key][0].is_set():
+                    del self.flights[key]
+
+class LimitedClient():
+    '''
+    Proxy of a boto3 client, as returned by ClientPool.client.
+    Each API call first takes a token from the TokenBucket of
+    its profile and region.
+    
+    Calls that AWS throttles, or that fail to connect, are
+    retried up to MAX_RETRIES times, after a random delay of
+    up to BASE_BACKOFF * 2**attempt sec (exponential backoff
+    with full jitter), so that several users of one account
+    do not retry in step. Throttled calls are counted by the
+    pool. Attributes that are not API calls are passed through.
+    
+    Identical describe calls of the same profile, region and
+    priority go through the SingleFlight of the pool, so only
+    one of them is sent. The result of FRESH_CALLS is also reused for
+    FRESH_WINDOW sec. Any other call (e.g. stop_instances)
+    expires those results.
+    '''
+    def __init__(self, client, bucket, priority, pool, key):
+        self._client = client
+        self._bucket = bucket
+        self._priority = priority
+        self._pool = pool
+        self._key = key
+    
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or name in NOT_CALLS or \
+                not callable(attr):
+            return attr
+        if name.startswith('describe_'):
+            def call(*args, **kwargs):
+                # Callers of another priority do not share the
+                # call, so a user call never waits behind the
+                # reserve and the single retry of a background one.
+                key = (self._key, self._priority, name, repr(args),
+                       repr(sorted(kwargs.items())))
+                if name in FRESH_CALLS and 'NextToken' not in kwargs \
+                        and 'MaxResults' not in kwargs:
+                    window = FRESH_WINDOW
+                else:
+                    window = 0
+                return self._pool.flights.do(key, self._call,
+                                             attr, args, kwargs,
+                                             window = window)
+        else:
+            def call(*args, **kwargs):
+                try:
+                    return self._call(attr, args, kwargs)
+                finally:
+                    self._pool.flights.expire(self._key)
+        return call
+    
+    def _call(self, method, args, kwargs):
+        from botocore.exceptions import (ClientError, HTTPClientError,
+                ConnectionError as EndpointError)
+        attempt = 0
+        while True:
+            self._bucket.acquire(self._priority)
+            try:
+                return method(*args, **kwargs)
+            except ClientError as e:
+                code = e.response['Error']['Code']
+                if code in THROTTLE_ERRORS:
+                    self._pool.throttled(self._key)
+                    self._bucket.drain()
+                elif code not in RETRY_ERRORS:
+                    raise
+                if attempt >= MAX_RETRIES[self._priority]:
+                    raise
+            except (EndpointError, HTTPClientError):
+                if attempt >= MAX_RETRIES[self._priority]:
+                    raise
+            time.sleep(random.uniform(
+                    0, min(MAX_BACKOFF, BASE_BACKOFF * 2**attempt)))
+            attempt += 1
+
+class ClientPool():
+    '''
+    Cache of boto3 clients keyed by (profile, region), which
+    is shared by Backend and User_Data.
+
+    Building a session loads the service model and sets up the
+    credential chain, and a new client has to do a new TLS
+    handshake, so both are kept and reused across connects,
+    disconnects, and region changes. All clients use the same
+    tuned botocore Config. boto3 and botocore are imported
+    when the first session is created, which keeps them out
+    of the start up of the application.
+
+    Clients that were not used for max_idle sec are evicted,
+    and when a new client would exceed max_clients, the least
+    recently used are evicted first. The clients of the keys
+    given to pin() are never evicted, so the pool grows as
+    needed to hold them.
+    
+    The clients are returned wrapped in a LimitedClient, which
+    shares one TokenBucket per profile and region and retries
+    throttled calls. Its priority is the one set, with
+    set_priority, by the thread that asked for the client
+    (USER by default).
+    '''
+    def __init__(self, max_clients = 32, max_idle = 900):
+        self.max_clients = max_clients
+        self.max_idle = max_idle
+        self.config = None
+        # profile -> [session, credentials]
+        self.sessions = {}
+        # (profile, region) -> [client, time of last use]
+        self.clients = OrderedDict()
+        # Keys of the clients that are never evicted
+        self.pinned = set()
+        # (profile, region) -> TokenBucket
+        self.buckets = {}
+        # (profile, region) -> number of throttled calls, and
+        # time of the last one.
+        self.throttle_events = {}
+        self.throttled_at = 0
+        # Identical describe calls in flight (see LimitedClient)
+        self.flights = SingleFlight()
+        # Priority of the clients of each thread
+        self.local = threading.local()
+        # Creating sessions and clients is not thread safe
+        self.lock = threading.Lock()
+
+    def session(self, profile, credentials):
+        '''
+        Returns the boto3 session of profile, which is created
+        only the first time, or if the credentials changed.
+        credentials --> [access_key_id, secret_access_key]
+        '''
+        with self.lock:
+            return self._session(profile, credentials)
+
+    def _session(self, profile, credentials):
+        if profile in self.sessions:
+            sess, used_credentials = self.sessions[profile]
+            if credentials is None or credentials == used_credentials:
+                return sess
+            # Credentials changed, so clients are not valid
+            self._discard(profile)
+        import boto3
+        sess = boto3.Session(
+            aws_access_key_id = credentials[0],
+            aws_secret_access_key = credentials[1])
+        self.sessions[profile] = [sess, list(credentials)]
+        return sess
+
+    def client(self, profile, region, credentials = None):
+        '''
+        Returns the EC2 client of profile on region, which
+        is created only the first time, wrapped in a
+        LimitedClient.
+        credentials --> [access_key_id, secret_access_key]. It
+                        can be None if the profile has been
+                        used before.
+        '''
+        key = (profile, region)
+        with self.lock:
+            sess = self._session(profile, credentials)
+            if key in self.clients:
+                self.clients.move_to_end(key)
+                self.clients[key][1] = time.time()
+            else:
+                # Only a new client can push others out
+                self.evict()
+                if self.config is None:
+                    from botocore.config import Config
+                    self.config = Config(
+                        max_pool_connections = 20,
+                        connect_timeout = 5,
+                        read_timeout = 20,
+                        # Retries are done by LimitedClient
+                        retries = {'max_attempts': 1,
+                                   'mode': 'standard'})
+                client = sess.client('ec2', region_name = region,
+                                     config = self.config)
+                self.clients[key] = [client, time.time()]
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket()
+            return LimitedClient(self.clients[key][0],
+                                 self.buckets[key],
+                                 self.priority(), self, key)
+    
+    def pin(self, keys):
+        '''
+        keys --> list of (profile, region) whose clients are
+        never evicted (e.g. the targets of the connection, which
+        are used on every refresh), replacing the previous ones.
+        '''
+        with self.lock:
+            self.pinned = set(keys)
+    
+    def set_priority(self, priority):
+        '''
+        Sets the priority (USER or BACKGROUND) of the clients
+        that are returned to the calling thread from now on.
+        '''
+        self.local.priority = priority
+    
+    def priority(self):
+        '''Returns the priority of the calling thread'''
+        return getattr(self.local, 'priority', USER)
+    
+    def throttled(self, key):
+        '''Counts a call of (profile, region) that AWS throttled'''
+        with self.lock:
+            self.throttle_events[key] = \
+                    self.throttle_events.get(key, 0) + 1
+            self.throttled_at = time.time()
+    
+    def throttleCount(self):
+        '''Returns the total number of throttled calls'''
+        with self.lock:
+            return sum(self.throttle_events.values())
+
+    def evict(self):
+        '''
+        Drops clients that are idle or above max_clients.
+        Must be called with self.lock held.
+        '''
+        limit = time.time() - self.max_idle
+        for key in list(self.clients.keys()):
+            if self.clients[key][1] < limit and key not in self.pinned:
+                del self.clients[key]
+        # Least recently used first, leaving room for one more
+        for key in list(self.clients.keys()):
+            if len(self.clients) < self.max_clients:
+                break
+            if key not in self.pinned:
+                del self.clients[key]
+
+    def discard(self, profile):
+        '''
+        Drops the session and all clients of profile (e.g.
+        when it is deleted, or its credentials were invalid).
+        '''
+        with self.lock:
+            self._discard(profile)
+
+    def _discard(self, profile):
+        self.sessions.pop(profile, None)
+        for key in list(self.clients.keys()):
+            if key[0] == profile:
+                del self.clients[key]
+
+# Pool used by the whole application
+client_pool = ClientPool()
@@ -0,0 +1,129 @@
+'''
+Collection of classes used to store the user data on the disk.
+'''
+import json
+import sqlite3
+import threading
+
+# Tables of Store --> their columns. The rows of every table,
+# apart from settings and metadata, keep the order of the
+# lists of User_Data with the position column.
+TABLES = {
+    'settings': ['key', 'value'],
+    'profiles': ['position', 'profile', 'access_key_id',
+                 'secret_access_key'],
+    'instance_view': ['position', 'label', 'visible'],
+    'images': ['position', 'image_id', 'name'],
+    'instance_types': ['position', 'instance_type'],
+    'key_pairs_files': ['position', 'key_name', 'data'],
+    'metadata': ['profile', 'region', 'name', 'data', 'time']}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS profiles (
+    position INTEGER PRIMARY KEY, profile TEXT,
+    access_key_id TEXT, secret_access_key TEXT);
+CREATE TABLE IF NOT EXISTS instance_view (
+    position INTEGER PRIMARY KEY, label TEXT, visible INTEGER);
+CREATE TABLE IF NOT EXISTS images (
+    position INTEGER PRIMARY KEY, image_id TEXT, name TEXT);
+CREATE TABLE IF NOT EXISTS instance_types (
+    position INTEGER PRIMARY KEY, instance_type TEXT);
+CREATE TABLE IF NOT EXISTS key_pairs_files (
+    position INTEGER PRIMARY KEY, key_name TEXT, data TEXT);
+CREATE TABLE IF NOT EXISTS metadata (
+    profile TEXT, region TEXT, name TEXT, data TEXT, time REAL,
+    PRIMARY KEY (profile, region, name));
+'''
+
+class Store():
+    '''
+    SQLite database with the data of User_Data and
+    MetadataCache.
+
+    Each group of attributes has its own table, so a change
+    only rewrites the tables it touches, within a single
+    transaction (either all of them are written or none).
+    The WAL journal lets the data be read while a write from
+    another thread is running.
+    '''
+    def __init__(self, path = 'resources/user_data.db'):
+        self.path = path
+        # The connection is shared by the GUI thread and the
+        # background threads, one at a time.
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def isEmpty(self):
+        '''
+        Returns True if nothing has been saved yet.
+        '''
+        with self.lock:
+            row = self.conn.execute(
+                    'SELECT COUNT(*) FROM settings').fetchone()
+        return row[0] == 0
+
+    def read(self, table):
+        '''
+        Returns list with the rows of table, sorted by position.
+        The settings are returned as dict {key: value}.
+        '''
+        columns = TABLES[table]
+        query = 'SELECT %s FROM %s' % (', '.join(columns), table)
+        if columns[0] == 'position':
+            query += ' ORDER BY position'
+        with self.lock:
+            rows = self.conn.execute(query).fetchall()
+        if table == 'settings':
+            settings = {}
+            for key, value in rows:
+                settings[key] = json.loads(value)
+            return settings
+        return rows
+
+    def write(self, tables):
+        '''
+        tables --> dict {table: rows}. The rows replace the
+                   whole table, apart from settings, which
+                   takes a dict {key: value} and only replaces
+                   the given keys. All the tables are written
+                   within a single transaction.
+        '''
+        with self.lock, self.conn:
+            for table, rows in tables.items():
+                columns = TABLES[table]
+                if table == 'settings':
+                    rows = [(k, json.dumps(v)) for k, v in rows.items()]
+                else:
+                    self.conn.execute('DELETE FROM %s' % table)
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+                        table, ', '.join(columns),
+                        ', '.join(['?']*len(columns))),
+                    rows)
+
+    def read_metadata(self):
+        '''
+        Returns dict (profile, region) --> {name: [values, time]}
+        with the rows of metadata.
+        '''
+        data = {}
+        for profile, region, name, values, t in self.read('metadata'):
+            data.setdefault((profile, region), {})[name] = \
+                    [json.loads(values), t]
+        return data
+
+    def put_metadata(self, target, name, values, t):
+        '''
+        Replaces a single row of metadata.
+        '''
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO metadata '
+                '(profile, region, name, data, time) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (target[0], target[1], name, json.dumps(values), t))
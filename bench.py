@@ -0,0 +1,367 @@
+'''
+Benchmark of the refresh of the instance table, using a fake
+EC2 client (no AWS account or network is needed):
+
+calls --> number of API calls per tick as the fleet grows,
+          for the old loop (one describe_instance_status per
+          running instance) and for Backend.fetch_target.
+memory --> memory per instance and normalization time of the
+          old list of dicts against the InstanceRecords.
+connect --> time to usable, i.e. from Backend.connect to the
+          end of the first full get_instances, for one region
+          and for several (see Backend.connect_timings).
+
+Run with:  python bench.py [sizes]
+e.g.       python bench.py 10,100,1000,5000
+The results are printed and written to bench_output.txt
+'''
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from DA_backend import Backend, ALL_REGIONS
+
+SIZES = [10, 100, 1000, 5000]
+# Number of regions, fleet per region and sec per API call
+# of the connect benchmark.
+REGIONS = [1, 4, 16]
+CONNECT_FLEET = 500
+LATENCY = 0.05
+STATES = ['running', 'running', 'running', 'stopped', 'pending']
+TYPES = ['t2.micro', 't2.small', 'm5.large', 'c5.xlarge']
+
+
+class FakeEC2():
+    '''
+    Minimal stand in for the boto3 EC2 client, with a fleet
+    of n instances. It pages its responses like AWS (only
+    if MaxResults is given) and counts the calls made to every
+    method in self.calls. Each call takes latency sec, and
+    regions are the ones returned by describe_regions. The
+    numbers of the InstanceIds start at first.
+    '''
+    def __init__(self, n, latency = 0, regions = ('eu-west-1',),
+                 first = 0):
+        self.calls = {}
+        self.latency = latency
+        self.regions = list(regions)
+        self.instances = [self.make_instance(k)
+                          for k in range(first, first + n)]
+
+    def make_instance(self, k):
+        '''
+        Returns dict with a single instance, as it appears in
+        the response of describe_instances.
+        '''
+        zone = 'eu-west-1' + 'abc'[k % 3]
+        return {'InstanceId': 'i-%017x' % k,
+                'State': {'Code': 16, 'Name': STATES[k % 5]},
+                'InstanceType': TYPES[k % 4],
+                'Placement': {'AvailabilityZone': zone,
+                              'Tenancy': 'default'},
+                'SecurityGroups': [{'GroupId': 'sg-0123456789',
+                                    'GroupName': 'default'}],
+                'ImageId': 'ami-0abcdef1234567890',
+                'KeyName': 'my-key',
+                'PublicDnsName': 'ec2-%d.compute.amazonaws.com' % k,
+                'PublicIpAddress': '34.0.%d.%d' % (k // 256 % 256,
+                                                   k % 256),
+                'PrivateDnsName': 'ip-%d.internal' % k,
+                'PrivateIpAddress': '10.0.%d.%d' % (k // 256 % 256,
+                                                    k % 256),
+                'VpcId': 'vpc-0123456789',
+                'SubnetId': 'subnet-0123456789',
+                'LaunchTime': '2018-06-20T00:00:00.000Z',
+                'Tags': [{'Key': 'Owner', 'Value': 'bench'},
+                         {'Key': 'Name', 'Value': 'node-%d' % k}]}
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def total(self):
+        return sum(self.calls.values())
+
+    def page(self, items, kwargs):
+        '''
+        Returns [items of the page, NextToken or None]
+        '''
+        start = int(kwargs.get('NextToken', 0))
+        end = start + kwargs.get('MaxResults', len(items))
+        token = str(end) if end < len(items) else None
+        return [items[start:end], token]
+
+    def describe_instances(self, **kwargs):
+        self.count('describe_instances')
+        items = self.instances
+        if 'InstanceIds' in kwargs:
+            ids = set(kwargs['InstanceIds'])
+            items = [i for i in items if i['InstanceId'] in ids]
+        items, token = self.page(items, kwargs)
+        # One instance per reservation, as when launched one by one
+        r = {'Reservations': [{'ReservationId': 'r-%s' % i['InstanceId'],
+                               'Instances': [i]} for i in items]}
+        if token:
+            r['NextToken'] = token
+        return r
+
+    def describe_instance_status(self, **kwargs):
+        self.count('describe_instance_status')
+        items = self.instances
+        if 'InstanceIds' in kwargs:
+            ids = set(kwargs['InstanceIds'])
+            items = [i for i in items if i['InstanceId'] in ids]
+        elif not kwargs.get('IncludeAllInstances'):
+            items = [i for i in items if i['State']['Name'] == 'running']
+        items, token = self.page(items, kwargs)
+        ok = {'Status': 'ok'}
+        r = {'InstanceStatuses': [{'InstanceId': i['InstanceId'],
+                                   'InstanceState': i['State'],
+                                   'InstanceStatus': ok,
+                                   'SystemStatus': ok} for i in items]}
+        if token:
+            r['NextToken'] = token
+        return r
+
+    def describe_regions(self, **kwargs):
+        self.count('describe_regions')
+        return {'Regions': [{'RegionName': r} for r in self.regions]}
+
+    def describe_key_pairs(self, **kwargs):
+        self.count('describe_key_pairs')
+        return {'KeyPairs': [{'KeyName': 'my-key'}]}
+
+    def describe_security_groups(self, **kwargs):
+        self.count('describe_security_groups')
+        return {'SecurityGroups': [{'GroupName': 'default'}]}
+
+    def describe_vpcs(self, **kwargs):
+        self.count('describe_vpcs')
+        return {'Vpcs': [{'VpcId': 'vpc-0123456789'}]}
+
+    def describe_images(self, **kwargs):
+        self.count('describe_images')
+        return {'Images': [{'ImageId': i, 'Name': 'image'}
+                           for i in kwargs.get('ImageIds', [])]}
+
+
+def emptyInstanceData():
+    '''
+    Dict used by the old get_instances for every instance
+    '''
+    return {'InstanceName': '', 'InstanceId': '', 'InstanceState': '',
+            'InstanceType': '', 'StatusCheck': '',
+            'AvailabilityZone': '', 'SecurityGroupId': '',
+            'SecurityGroupName': '', 'ImageId': '', 'KeyName': '',
+            'PublicDns': '', 'PublicIp': '', 'PrivateDns': '',
+            'PrivateIp': '', 'VpcId': '', 'SubnetId': ''}
+
+
+def old_get_instances(client, statusChecks = True):
+    '''
+    The old get_instances: a single describe_instances call,
+    the first instance of every reservation copied into a
+    dict, and one describe_instance_status call per running
+    instance (if statusChecks). Returns [list of dicts, the
+    raw response that was also kept].
+    '''
+    instancesDataBig = client.describe_instances()
+    instancesData = []
+    d = emptyInstanceData()
+    for y in instancesDataBig['Reservations']:
+        i = y['Instances'][0]
+        d['InstanceName'] = ''
+        for t in i.get('Tags', []):
+            if t['Key'] == 'Name':
+                d['InstanceName'] = t['Value']
+        d['InstanceId'] = i['InstanceId']
+        d['InstanceState'] = i['State']['Name']
+        d['InstanceType'] = i['InstanceType']
+        d['AvailabilityZone'] = i['Placement']['AvailabilityZone']
+        d['SecurityGroupId'] = i['SecurityGroups'][0]['GroupId']
+        d['SecurityGroupName'] = i['SecurityGroups'][0]['GroupName']
+        d['ImageId'] = i['ImageId']
+        d['KeyName'] = i.get('KeyName', '')
+        d['PublicDns'] = i.get('PublicDnsName', '')
+        d['PublicIp'] = i.get('PublicIpAddress', '')
+        d['PrivateDns'] = i.get('PrivateDnsName', '')
+        d['PrivateIp'] = i.get('PrivateIpAddress', '')
+        d['VpcId'] = i.get('VpcId', '')
+        d['SubnetId'] = i.get('SubnetId', '')
+        d['StatusCheck'] = ''
+        if statusChecks and d['InstanceState'] == 'running':
+            s = client.describe_instance_status(
+                    InstanceIds = [d['InstanceId']])
+            s = s['InstanceStatuses'][0]
+            if s['InstanceStatus']['Status'] == 'ok' and \
+               s['SystemStatus']['Status'] == 'ok':
+                d['StatusCheck'] = '2/2 checks passed'
+            else:
+                d['StatusCheck'] = 'Initializing'
+        instancesData.append(d.copy())
+    return [instancesData, instancesDataBig]
+
+
+def new_backend(clients = None):
+    '''
+    Returns Backend with a saved profile, whose sessions and
+    clients are the FakeEC2s of clients (region --> FakeEC2).
+    It must run in a folder with an empty resources/.
+    '''
+    backend = Backend()
+    u = backend.user_data
+    u.profile = ['bench']
+    u.access_key_id = ['AKIABENCH']
+    u.secret_access_key = ['secret']
+    if clients:
+        u.ec2_regions = list(clients)
+        u.default_region = u.ec2_regions[0]
+        backend.get_session = lambda profile: object()
+        backend.get_client = lambda profile, region: clients[region]
+    return backend
+
+
+def bench_calls(backend, sizes):
+    '''
+    Returns lines with the API calls of a single tick (a
+    refresh of one region) for every fleet size in sizes.
+    The new calls only grow by one page of each request per
+    1000 instances.
+    '''
+    lines = ['API calls per tick (one region, 1000 per page)',
+             '%8s %10s %10s' % ('fleet', 'old', 'new')]
+    for n in sizes:
+        old = FakeEC2(n)
+        old_get_instances(old)
+        new = FakeEC2(n)
+        instancesData, latency, error = backend.fetch_target(
+                                            new, ['bench', 'eu-west-1'])
+        assert error == '' and len(instancesData) == n
+        lines.append('%8d %10d %10d' % (n, old.total(), new.total()))
+    return lines
+
+
+def measure(build):
+    '''
+    Returns [memory in bytes kept by the result of build(),
+    best time of build() in sec].
+    '''
+    best = None
+    for k in range(5):
+        start = time.perf_counter()
+        build()
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    kept = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return [kept, best]
+
+
+def bench_memory(backend, sizes):
+    '''
+    Returns lines with the memory per instance and the
+    normalization time of the old list of dicts (with and
+    without the raw response it also kept) and of the
+    InstanceRecords, for every fleet size in sizes.
+    '''
+    lines = ['Memory per instance (bytes) and normalization time (ms)',
+             '%8s %12s %12s %12s %10s %10s' % (
+                 'fleet', 'old dicts', 'old + raw', 'records',
+                 'old ms', 'new ms')]
+    target = ['bench', 'eu-west-1']
+    for n in sizes:
+        client = FakeEC2(n)
+        # Responses are built once, so that only the
+        # normalization is timed and measured.
+        page = client.describe_instances()
+        status = backend.get_status_checks(client)
+        client.describe_instances = lambda **kwargs: page
+        client.describe_instance_status = \
+            lambda **kwargs: {'InstanceStatuses': [
+                {'InstanceStatus': {'Status': 'ok'},
+                 'SystemStatus': {'Status': 'ok'}}]}
+        old_kept, old_t = measure(
+            lambda: old_get_instances(client, False)[0])
+        # The old get_instances also kept the whole response,
+        # while iter_instances drops every page once it is read.
+        raw_kept = old_kept + measure(
+            lambda: FakeEC2(n).describe_instances())[0]
+        new_kept, new_t = measure(
+            lambda: {d.InstanceId: d for d in backend.iter_instances(
+                         client, status, None, True, target)})
+        lines.append('%8d %12.0f %12.0f %12.0f %10.2f %10.2f' % (
+            n, old_kept / n, raw_kept / n, new_kept / n,
+            old_t * 1000, new_t * 1000))
+    return lines
+
+
+def bench_connect(regions = REGIONS):
+    '''
+    Returns lines with the time to usable of connect, for
+    every number of regions in regions, each with a fleet of
+    CONNECT_FLEET and API calls of LATENCY sec.
+    '''
+    lines = ['Time to usable (ms, %d instances per region, %d ms per '
+             'call)' % (CONNECT_FLEET, LATENCY * 1000),
+             '%8s %10s %10s %10s %10s' % (
+                 'regions', 'validate', 'returned', 'instances',
+                 'shown')]
+    for n in regions:
+        names = ['bench-%d' % k for k in range(n)]
+        clients = {}
+        for k, r in enumerate(names):
+            clients[r] = FakeEC2(CONNECT_FLEET, LATENCY, names,
+                                 k * CONNECT_FLEET)
+        backend = new_backend(clients)
+        start = time.perf_counter()
+        if n == 1:
+            error = backend.connect('bench', names[0])
+        else:
+            error = backend.connect('bench', ALL_REGIONS)
+        returned = time.perf_counter() - start
+        assert error == 'NoError', error
+        backend.get_instances()
+        assert len(backend.instancesData) == n * CONNECT_FLEET
+        t = backend.connect_timings
+        lines.append('%8d %10.0f %10.0f %10.0f %10d' % (
+            n, t['validate'] * 1000, returned * 1000,
+            t['instances'] * 1000, len(backend.instancesData)))
+        backend.executor.shutdown()
+        backend.user_data.flush()
+    return lines
+
+
+def main(sizes = SIZES):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        # The user data of the benchmark are saved in folder
+        os.chdir(folder)
+        os.mkdir('resources')
+        try:
+            backend = new_backend()
+            lines = bench_calls(backend, sizes)
+            lines.append('')
+            lines += bench_memory(backend, sizes)
+            backend.user_data.flush()
+            lines.append('')
+            lines += bench_connect()
+        finally:
+            os.chdir(cwd)
+    text = '\n'.join(lines)
+    print(text)
+    with open('bench_output.txt', 'w') as f:
+        f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main([int(n) for n in sys.argv[1].split(',')])
+    else:
+        main()
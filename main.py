@@ -1,4 +1,7 @@
+import time
+start = time.perf_counter()
 from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QTimer
 import sys
 from DA_backend import Backend
 from DA_GuiMainWin import Main
@@ -13,4 +16,21 @@ if __name__ == '__main__':
     # Builds main interface, and passes in the backend.
     main = Main(app, backend)
     
-    sys.exit(app.exec_())
\ No newline at end of file
+    # With --startup-time, prints the time until the first
+    # turn of the event loop (i.e. the first paint of the
+    # window) and until the regions are discovered, then
+    # quits. Run it twice to compare a cold and a warm start.
+    if '--startup-time' in sys.argv:
+        def firstPaint():
+            print('First paint: %.3f sec' % (time.perf_counter()-start))
+        def regionsReady():
+            print('Regions discovered: %.3f sec' % (time.perf_counter()-start))
+            app.quit()
+        QTimer.singleShot(0, firstPaint)
+        main.regionsReady.connect(regionsReady)
+    
+    # Once the window is on screen, boto3 is imported and
+    # the list of regions is updated in the background.
+    backend.discover_regions(callback = main.regionsReady.emit)
+    
+    sys.exit(app.exec_())